@@ -1,7 +1,12 @@
 import functools
 
-from .hook import pre_execute, pre_get_input_data
+from .hook import pre_execute, post_execute, pre_get_input_data, post_get_input_data
+from .utils.env import env_flag, env_int
+from .utils.prehash import get_prehash_progress, start_prehash
+from .utils.deferred_hash import deferred_hash_queue
 import execution
+from aiohttp import web
+from server import PromptServer
 
 
 # refer. https://stackoverflow.com/a/35758398
@@ -14,10 +19,40 @@ def prefix_function(function, prefunction):
     return run
 
 
-execution.PromptExecutor.execute = prefix_function(
-    execution.PromptExecutor.execute, pre_execute
+def suffix_function(function, postfunction):
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        result = function(*args, **kwargs)
+        postfunction(result, *args, **kwargs)
+        return result
+
+    return run
+
+
+execution.PromptExecutor.execute = suffix_function(
+    prefix_function(execution.PromptExecutor.execute, pre_execute),
+    post_execute,
 )
 
-execution.get_input_data = prefix_function(
-    execution.get_input_data, pre_get_input_data
+execution.get_input_data = suffix_function(
+    prefix_function(execution.get_input_data, pre_get_input_data),
+    post_get_input_data,
 )
+
+# Opt-in: hash the model folders in the background so the first save with calc_model_hash does not stall
+if env_flag("EAGLE_PREHASH"):
+    start_prehash(env_int("EAGLE_PREHASH_WORKERS", 2))
+
+
+@PromptServer.instance.routes.get("/eagle/prehash/progress")
+async def prehash_progress(request):
+    # {"enabled": false} unless EAGLE_PREHASH is set
+    progress = get_prehash_progress()
+    if progress is None:
+        return web.json_response({"enabled": False})
+    return web.json_response({"enabled": True, **progress})
+
+
+# resume the Eagle hash updates left pending by the previous run (EAGLE_DEFERRED_HASH)
+if deferred_hash_queue is not None:
+    deferred_hash_queue.start()
@@ -4,9 +4,11 @@ from collections import defaultdict
 
 
 from . import hook
-from .defs.captures import CAPTURE_FIELD_LIST
+from .trace import Trace, TraceIndex
+from .defs import CAPTURE_PLANS
 from .defs.meta import MetaField
 from .defs.textencodes import TEXT_ENCODE_CLASSES
+from .utils.hash import DEFAULT_HASH_ALGORITHM, get_autov2_hash, get_hash_label, prefetch_hashes
 
 from nodes import NODE_CLASS_MAPPINGS
 from execution import get_input_data
@@ -35,6 +37,409 @@ class _ExecutionListProxy:
         return self._outputs_cache.get(node_id)
 
 
+class CaptureSnapshot:
+    """Inputs of the captured nodes, resolved once and projected per batch index.
+
+    Only list-valued fields depend on the batch index, so indexes past the longest
+    list share the projection of index 0.
+    """
+
+    def __init__(self, captured_nodes, prompt_lookup, extra_data, outputs, calc_model_hash):
+        self.captured_nodes = captured_nodes
+        self.prompt_lookup = prompt_lookup
+        self.extra_data = extra_data
+        self.outputs = outputs
+        self.calc_model_hash = calc_model_hash
+        self.index_span = self._get_index_span(captured_nodes)
+        self._fields_by_meta = self._group_fields_by_meta(captured_nodes)
+        self._hash_metas = {
+            meta
+            for meta, fields in self._fields_by_meta.items()
+            if any(field.collect_hash_paths is not None for _, field in fields)
+        }
+        self._prefetched_indexes = set()
+        self._projections = {}
+
+    @staticmethod
+    def _get_index_span(captured_nodes):
+        span = 1
+        for _, _, _, class_type, input_data in captured_nodes:
+            for field in CAPTURE_PLANS[class_type]:
+                if field.field_name is None:
+                    continue
+                value = input_data[0].get(field.field_name)
+                if isinstance(value, list):
+                    span = max(span, len(value))
+        return span
+
+    def projection_key(self, index):
+        return index if 0 <= index < self.index_span else 0
+
+    def get_inputs(self, index):
+        key = self.projection_key(index)
+        inputs = self._projections.get(key)
+        if inputs is None:
+            inputs = LazyInputs(
+                self._fields_by_meta.keys(),
+                lambda meta: self._extract_meta(meta, key),
+            )
+            self._projections[key] = inputs
+        return inputs
+
+    def _extract_meta(self, meta, index):
+        if self.calc_model_hash and meta in self._hash_metas:
+            self._prefetch_hashes(index)
+
+        entries = []
+        for (node_id, display_node_id, node_obj, _, input_data), field in self._fields_by_meta[meta]:
+            for v in field.extract(
+                node_id,
+                display_node_id,
+                node_obj,
+                self.prompt_lookup,
+                self.extra_data,
+                self.outputs,
+                input_data,
+                index,
+                self.calc_model_hash,
+            ):
+                entries.append((node_id, v))
+        return entries
+
+    def _prefetch_hashes(self, index):
+        """Hash every file the hash fields of this projection need, concurrently."""
+        if index in self._prefetched_indexes:
+            return
+        self._prefetched_indexes.add(index)
+
+        filenames = []
+        for meta in self._hash_metas:
+            for (node_id, display_node_id, node_obj, _, input_data), field in self._fields_by_meta[meta]:
+                if field.collect_hash_paths is None:
+                    continue
+                try:
+                    filenames.extend(
+                        field.collect_hash_paths(
+                            node_id,
+                            display_node_id,
+                            node_obj,
+                            self.prompt_lookup,
+                            self.extra_data,
+                            self.outputs,
+                            input_data,
+                            index,
+                            self.calc_model_hash,
+                        )
+                    )
+                except Exception:
+                    # the field reports the problem itself when it is extracted
+                    continue
+        prefetch_hashes(filenames)
+
+    @staticmethod
+    def _group_fields_by_meta(captured_nodes):
+        fields_by_meta = defaultdict(list)
+        for captured_node in captured_nodes:
+            for field in CAPTURE_PLANS[captured_node[3]]:
+                fields_by_meta[field.meta].append((captured_node, field))
+        return fields_by_meta
+
+
+class LazyInputs:
+    """Captured entries per MetaField, extracted on first access."""
+
+    def __init__(self, metas, extract):
+        self.metas = tuple(metas)
+        self._extract = extract
+        self._entries = {}
+
+    def get(self, meta, default=None):
+        if meta not in self.metas:
+            return default
+        entries = self._entries.get(meta)
+        if entries is None:
+            entries = self._extract(meta)
+            self._entries[meta] = entries
+        return entries if entries else default
+
+    def items(self):
+        for meta in self.metas:
+            entries = self.get(meta)
+            if entries:
+                yield meta, entries
+
+    def keys(self):
+        return [meta for meta, _ in self.items()]
+
+    def __getitem__(self, meta):
+        entries = self.get(meta)
+        if entries is None:
+            raise KeyError(meta)
+        return entries
+
+    def __contains__(self, meta):
+        return self.get(meta) is not None
+
+
+class PngInfoSnapshot:
+    """PNGInfo of one execution, generated once per distinct batch projection."""
+
+    def __init__(
+        self,
+        capture_snapshot,
+        trace_tree_from_this_node,
+        trace_tree_from_sampler_node,
+        save_civitai_sampler,
+        calc_model_hash,
+        trace_index=None,
+    ):
+        self.capture_snapshot = capture_snapshot
+        self.trace_index = trace_index
+        self.trace_tree_from_this_node = trace_tree_from_this_node
+        self.trace_tree_from_sampler_node = trace_tree_from_sampler_node
+        self.save_civitai_sampler = save_civitai_sampler
+        self.calc_model_hash = calc_model_hash
+        self._pnginfo_fields = {}
+
+    def gen_pnginfo_dict(self, index):
+        """Returns a LazyPngInfo; the per-image entries set on it do not leak to other images."""
+        return LazyPngInfo(self._gen_pnginfo_fields(index))
+
+    def _gen_pnginfo_fields(self, index):
+        key = self.capture_snapshot.projection_key(index)
+        pnginfo_fields = self._pnginfo_fields.get(key)
+        if pnginfo_fields is None:
+            inputs = self.capture_snapshot.get_inputs(key)
+            pnginfo_fields = PngInfoFields(
+                self._filter_inputs(inputs, self.trace_tree_from_sampler_node),
+                self._filter_inputs(inputs, self.trace_tree_from_this_node),
+                self.save_civitai_sampler,
+                self.calc_model_hash,
+            )
+            self._pnginfo_fields[key] = pnginfo_fields
+        return pnginfo_fields
+
+    def _filter_inputs(self, inputs, trace_tree):
+        return LazyInputs(
+            inputs.metas,
+            lambda meta: Trace.filter_entries_by_trace_tree(
+                inputs.get(meta, []), trace_tree, self.trace_index
+            ),
+        )
+
+
+class PngInfoFields:
+    """
+    PNGInfo fields of one batch projection, computed group by group on first access.
+
+    Each group lists the keys it produces (None for the numbered Lora_/Embedding_ keys),
+    so looking up e.g. "Seed" never runs the embedding or hash formatters.
+    """
+
+    GROUPS = (
+        (("Positive prompt",), "_gen_positive_prompt"),
+        (("Negative prompt",), "_gen_negative_prompt"),
+        (("Steps",), "_gen_steps"),
+        (("Sampler",), "_gen_sampler"),
+        (("CFG scale",), "_gen_cfg"),
+        (("Seed",), "_gen_seed"),
+        (("Clip skip",), "_gen_clip_skip"),
+        (("Size",), "_gen_size"),
+        (("Model",), "_gen_model"),
+        (("Model hash",), "_gen_model_hash"),
+        (("VAE",), "_gen_vae"),
+        (("VAE hash",), "_gen_vae_hash"),
+        (None, "_gen_loras"),
+        (None, "_gen_embeddings"),
+        (("Hashes", "Hash algorithm"), "_gen_hashes"),
+    )
+    DYNAMIC_KEY_PREFIXES = {"Lora_": "_gen_loras", "Embedding_": "_gen_embeddings"}
+    GROUP_BY_KEY = {key: group for keys, group in GROUPS if keys for key in keys}
+
+    def __init__(self, inputs_before_sampler_node, inputs_before_this_node, save_civitai_sampler, calc_model_hash):
+        self.inputs_before_sampler_node = inputs_before_sampler_node
+        self.inputs_before_this_node = inputs_before_this_node
+        self.save_civitai_sampler = save_civitai_sampler
+        self.calc_model_hash = calc_model_hash
+        self._groups = {}
+
+    def get(self, key, default=None):
+        group = self.GROUP_BY_KEY.get(key)
+        if group is None:
+            for prefix, prefix_group in self.DYNAMIC_KEY_PREFIXES.items():
+                if key.startswith(prefix):
+                    group = prefix_group
+                    break
+            else:
+                return default
+        return self._get_group(group).get(key, default)
+
+    def to_dict(self):
+        pnginfo_dict = {}
+        for _, group in self.GROUPS:
+            pnginfo_dict.update(self._get_group(group))
+        return pnginfo_dict
+
+    def _get_group(self, group):
+        fields = self._groups.get(group)
+        if fields is None:
+            fields = getattr(self, group)()
+            self._groups[group] = fields
+        return fields
+
+    def _field(self, inputs, metafield, key):
+        entry_value = Capture._value_from_entries(inputs.get(metafield, []))
+        if entry_value is None:
+            return {}
+        return {key: entry_value}
+
+    def _gen_positive_prompt(self):
+        return self._field(
+            self.inputs_before_sampler_node, MetaField.POSITIVE_PROMPT, "Positive prompt"
+        )
+
+    def _gen_negative_prompt(self):
+        return self._field(
+            self.inputs_before_sampler_node, MetaField.NEGATIVE_PROMPT, "Negative prompt"
+        )
+
+    def _gen_steps(self):
+        return self._field(self.inputs_before_sampler_node, MetaField.STEPS, "Steps")
+
+    def _gen_sampler(self):
+        sampler_names = self.inputs_before_sampler_node.get(MetaField.SAMPLER_NAME, [])
+        schedulers = self.inputs_before_sampler_node.get(MetaField.SCHEDULER, [])
+
+        if (self.save_civitai_sampler):
+            return {"Sampler": Capture.get_sampler_for_civitai(sampler_names, schedulers)}
+
+        sampler_name_value = Capture._value_from_entries(sampler_names)
+        scheduler_value = Capture._value_from_entries(schedulers)
+        if sampler_name_value is None:
+            return {}
+
+        if scheduler_value and scheduler_value != "normal":
+            sampler_name_value += "_" + scheduler_value
+        return {"Sampler": sampler_name_value}
+
+    def _gen_cfg(self):
+        return self._field(self.inputs_before_sampler_node, MetaField.CFG, "CFG scale")
+
+    def _gen_seed(self):
+        return self._field(self.inputs_before_sampler_node, MetaField.SEED, "Seed")
+
+    def _gen_clip_skip(self):
+        return self._field(self.inputs_before_sampler_node, MetaField.CLIP_SKIP, "Clip skip")
+
+    def _gen_size(self):
+        image_widths = self.inputs_before_sampler_node.get(MetaField.IMAGE_WIDTH, [])
+        image_heights = self.inputs_before_sampler_node.get(MetaField.IMAGE_HEIGHT, [])
+        width_value = Capture._value_from_entries(image_widths)
+        height_value = Capture._value_from_entries(image_heights)
+        if width_value is None or height_value is None:
+            return {}
+        return {"Size": f"{width_value}x{height_value}"}
+
+    def _gen_model(self):
+        return self._field(self.inputs_before_sampler_node, MetaField.MODEL_NAME, "Model")
+
+    def _gen_model_hash(self):
+        if not self.calc_model_hash:
+            return {}
+        return self._field(self.inputs_before_sampler_node, MetaField.MODEL_HASH, "Model hash")
+
+    def _gen_vae(self):
+        return self._field(self.inputs_before_this_node, MetaField.VAE_NAME, "VAE")
+
+    def _gen_vae_hash(self):
+        if not self.calc_model_hash:
+            return {}
+        return self._field(self.inputs_before_this_node, MetaField.VAE_HASH, "VAE hash")
+
+    def _gen_loras(self):
+        return Capture.gen_loras(self.inputs_before_sampler_node, self.calc_model_hash)
+
+    def _gen_embeddings(self):
+        return Capture.gen_embeddings(self.inputs_before_sampler_node, self.calc_model_hash)
+
+    def _gen_hashes(self):
+        if not self.calc_model_hash:
+            return {}
+        hashes_for_civitai = Capture.get_hashes_for_civitai(
+            self.inputs_before_sampler_node, self.inputs_before_this_node
+        )
+        if len(hashes_for_civitai) == 0:
+            return {}
+        # parsers read every Hashes entry as an AutoV2 resource hash: SHA256 digests are
+        # shortened, AutoV1 ones only stay in the "... hash" fields
+        autov2_hashes = {}
+        algorithms = set()
+        for name, value in hashes_for_civitai.items():
+            autov2_hash = get_autov2_hash(value)
+            if autov2_hash is not None:
+                autov2_hashes[name] = autov2_hash
+            algorithms.add(getattr(value, "algorithm", DEFAULT_HASH_ALGORITHM))
+        fields = {}
+        if autov2_hashes:
+            fields["Hashes"] = json.dumps(autov2_hashes)
+        # at most one other algorithm is configured; files hashed with AutoV2 instead of it
+        # (non-checkpoints and small files under autov1) are told apart by their length
+        algorithms.discard(DEFAULT_HASH_ALGORITHM)
+        if algorithms:
+            fields["Hash algorithm"] = get_hash_label(algorithms.pop())
+        return fields
+
+
+class LazyPngInfo:
+    """
+    PNGInfo dict of one image, backed by shared PngInfoFields.
+
+    Entries set by the caller (extra metadata, batch index, manual prompts) are kept
+    apart and applied in assignment order, exactly as on a plain dict.
+    """
+
+    def __init__(self, fields):
+        self._fields = fields
+        self._overrides = {}
+
+    def get(self, key, default=None):
+        if key in self._overrides:
+            return self._overrides[key]
+        return self._fields.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._overrides[key] = value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def to_dict(self):
+        pnginfo_dict = self._fields.to_dict()
+        pnginfo_dict.update(self._overrides)
+        return pnginfo_dict
+
+    def items(self):
+        return self.to_dict().items()
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+
+_MISSING = object()
+
+
 class Capture:
     @staticmethod
     def _select_latest_value(value):
@@ -63,7 +468,18 @@ class Capture:
 
     @classmethod
     def get_inputs(cls, calc_model_hash, index, include_prompts=True):
-        inputs = defaultdict(list)
+        return cls.snapshot(calc_model_hash, include_prompts).get_inputs(index)
+
+    @classmethod
+    def snapshot(cls, calc_model_hash, include_prompts=True, trace_tree=None, trace_index=None):
+        """
+        Resolve the inputs of every captured node once for the current execution.
+
+        When trace_tree is given, only the nodes upstream of the save node (the ones
+        that can survive Trace.filter_inputs_by_trace_tree) are resolved.
+        """
+        if trace_tree is not None and trace_index is None:
+            trace_index = TraceIndex({})
         prompt = hook.current_prompt
         extra_data = hook.current_extra_data
         prompt_executor = getattr(hook, "prompt_executer", None)
@@ -92,6 +508,7 @@ class Capture:
 
         node_ids = list(dynprompt.all_node_ids()) if dynprompt is not None else list(prompt.keys())
 
+        captured_nodes = []
         for node_id in sorted(node_ids, key=str):
             node_obj = None
             if dynprompt is not None and dynprompt.has_node(node_id):
@@ -107,7 +524,9 @@ class Capture:
             class_type = node_obj.get("class_type")
             if not include_prompts and class_type in TEXT_ENCODE_CLASSES:
                 continue
-            if class_type not in CAPTURE_FIELD_LIST:
+            if class_type not in CAPTURE_PLANS:
+                continue
+            if trace_tree is not None and trace_index.resolve_in(node_id, trace_tree) is None:
                 continue
             obj_class = NODE_CLASS_MAPPINGS[class_type]
             node_inputs = node_obj.get("inputs", {})
@@ -117,147 +536,44 @@ class Capture:
                 # custom hooks lost the PromptExecutor reference). Skip gracefully to
                 # avoid crashing the whole workflow – metadata will just be partial.
                 continue
-            try:
-                input_data = get_input_data(
-                    node_inputs,
-                    obj_class,
-                    node_id,
-                    execution_list,
-                    dynprompt,
-                    extra_data,
-                )
-            except Exception:
-                # The upstream cache might still be rebuilding; skip capturing this
-                # node and continue harvesting what is available.
-                continue
+            # reuse the inputs recorded while the node executed (EAGLE_RECORD_INPUTS);
+            # nodes served from the cache were not executed and are resolved here
+            input_data = hook.get_recorded_inputs(node_id)
+            if input_data is None:
+                try:
+                    input_data = get_input_data(
+                        node_inputs,
+                        obj_class,
+                        node_id,
+                        execution_list,
+                        dynprompt,
+                        extra_data,
+                    )
+                except Exception:
+                    # The upstream cache might still be rebuilding; skip capturing this
+                    # node and continue harvesting what is available.
+                    continue
 
             # if class_type not in ["KSampler"]:
             #     print("Capturing inputs for node:", node_id, "Class type:", class_type, "Input data:", input_data)
 
             display_node_id = dynprompt.get_display_node_id(node_id)
+            captured_nodes.append(
+                (node_id, display_node_id, node_obj, class_type, input_data)
+            )
 
-            metas = CAPTURE_FIELD_LIST[class_type]
-            for meta, field_data in metas.items():
-                validate = field_data.get("validate")
-                if validate is not None and not validate(
-                    display_node_id, node_obj, prompt_lookup, extra_data, outputs, input_data
-                ):
-                    continue
-
-                value = field_data.get("value")
-                if value is not None:
-                    inputs[meta].append((node_id, value))
-                    continue
-
-                selector = field_data.get("selector")
-                if selector is not None:
-                    v = selector(
-                        node_id, node_obj, prompt_lookup, extra_data, outputs, input_data
-                    )
-                    if isinstance(v, list):
-                        for x in v:
-                            inputs[meta].append((node_id, x))
-                    elif v is not None:
-                        inputs[meta].append((node_id, v))
-                    continue
-
-                field_name = field_data["field_name"]
-                value = input_data[0].get(field_name)
-                if value is not None:
-                    # print("Capturing value for field:", field_name, "NodeID:", node_id, "Value:", value)
-                    format = field_data.get("format")
-
-                    if isinstance(value, list) and len(value) > 0:
-                        if len(value) > index:
-                            v = value[index]
-                        else:
-                            v = value[0]
-                    else:
-                        v = value
-
-                    if format is not None:
-                        # formatのメソッド名が「_hash」で終わる場合、かつ、calc_model_hashがFalseの場合はメソッドを呼び出さずNoneにする
-                        if format.__name__.endswith("_hash") and not calc_model_hash:
-                            v = None
-                        else:
-                            v = format(v, input_data)
-                    if isinstance(v, list):
-                        for x in v:
-                            inputs[meta].append((node_id, x))
-                    else:
-                        inputs[meta].append((node_id, v))
-
-        # print("Final captured inputs:", dict(inputs))
-        return inputs
+        return CaptureSnapshot(
+            captured_nodes, prompt_lookup, extra_data, outputs, calc_model_hash
+        )
 
     @classmethod
     def gen_pnginfo_dict(cls, inputs_before_sampler_node, inputs_before_this_node, save_civitai_sampler, calc_model_hash):
-        pnginfo_dict = {}
-
-        def update_pnginfo_dict(inputs, metafield, key):
-            entries = inputs.get(metafield, [])
-            entry_value = cls._value_from_entries(entries)
-            if entry_value is not None:
-                pnginfo_dict[key] = entry_value
-
-        update_pnginfo_dict(
-            inputs_before_sampler_node, MetaField.POSITIVE_PROMPT, "Positive prompt"
-        )
-        update_pnginfo_dict(
-            inputs_before_sampler_node, MetaField.NEGATIVE_PROMPT, "Negative prompt"
-        )
-
-        update_pnginfo_dict(inputs_before_sampler_node, MetaField.STEPS, "Steps")
-
-        sampler_names = inputs_before_sampler_node.get(MetaField.SAMPLER_NAME, [])
-        schedulers = inputs_before_sampler_node.get(MetaField.SCHEDULER, [])
-
-        if (save_civitai_sampler):
-            pnginfo_dict["Sampler"] = cls.get_sampler_for_civitai(sampler_names, schedulers)
-        else:
-            sampler_name_value = cls._value_from_entries(sampler_names)
-            scheduler_value = cls._value_from_entries(schedulers)
-            if sampler_name_value is not None:
-                pnginfo_dict["Sampler"] = sampler_name_value
-
-                if scheduler_value and scheduler_value != "normal":
-                    pnginfo_dict["Sampler"] += "_" + scheduler_value
-
-        update_pnginfo_dict(inputs_before_sampler_node, MetaField.CFG, "CFG scale")
-        update_pnginfo_dict(inputs_before_sampler_node, MetaField.SEED, "Seed")
-
-        update_pnginfo_dict(
-            inputs_before_sampler_node, MetaField.CLIP_SKIP, "Clip skip"
-        )
-
-        image_widths = inputs_before_sampler_node.get(MetaField.IMAGE_WIDTH, [])
-        image_heights = inputs_before_sampler_node.get(MetaField.IMAGE_HEIGHT, [])
-        width_value = cls._value_from_entries(image_widths)
-        height_value = cls._value_from_entries(image_heights)
-        if width_value is not None and height_value is not None:
-            pnginfo_dict["Size"] = f"{width_value}x{height_value}"
-
-        update_pnginfo_dict(inputs_before_sampler_node, MetaField.MODEL_NAME, "Model")
-        if calc_model_hash:
-            update_pnginfo_dict(
-                inputs_before_sampler_node, MetaField.MODEL_HASH, "Model hash"
-            )
-
-        update_pnginfo_dict(inputs_before_this_node, MetaField.VAE_NAME, "VAE")
-        if calc_model_hash:
-            update_pnginfo_dict(inputs_before_this_node, MetaField.VAE_HASH, "VAE hash")
-
-        pnginfo_dict.update(cls.gen_loras(inputs_before_sampler_node, calc_model_hash))
-        pnginfo_dict.update(cls.gen_embeddings(inputs_before_sampler_node, calc_model_hash))
-
-        if calc_model_hash:
-            hashes_for_civitai = cls.get_hashes_for_civitai(
-                inputs_before_sampler_node, inputs_before_this_node
-            )
-            if len(hashes_for_civitai) > 0:
-                pnginfo_dict["Hashes"] = json.dumps(hashes_for_civitai)
-
-        return pnginfo_dict
+        return PngInfoFields(
+            inputs_before_sampler_node,
+            inputs_before_this_node,
+            save_civitai_sampler,
+            calc_model_hash,
+        ).to_dict()
 
     @classmethod
     def gen_parameters_str(cls, pnginfo_dict):
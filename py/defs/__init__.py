@@ -3,6 +3,7 @@ import importlib
 import os
 
 from .captures import CAPTURE_FIELD_LIST
+from .plans import compile_capture_plans
 from .samplers import SAMPLERS
 
 # load CAPTURE_FIELD_LIST and SAMPLERS in ext folder
@@ -16,3 +17,6 @@ for module_path in glob.glob(dir_name + "/ext/*.py"):
     module = importlib.import_module(package_name)
     CAPTURE_FIELD_LIST.update(getattr(module, "CAPTURE_FIELD_LIST", {}))
     SAMPLERS.update(getattr(module, "SAMPLERS", {}))
+
+# compile the capture definitions (including ext packs) into extractor plans once at load time
+CAPTURE_PLANS = compile_capture_plans(CAPTURE_FIELD_LIST)
@@ -1,6 +1,6 @@
 # https://github.com/yolain/ComfyUI-Easy-Use
 from ..meta import MetaField
-from ..formatters import calc_model_hash, calc_lora_hash, convert_skip_clip
+from ..formatters import calc_model_hash, lazy_lora_hash, convert_skip_clip
 import re
 
 def get_lora_model_name_stack(node_id, obj, prompt, extra_data, outputs, input_data):
@@ -9,7 +9,7 @@ def get_lora_model_name_stack(node_id, obj, prompt, extra_data, outputs, input_d
 
 def get_lora_model_hash_stack(node_id, obj, prompt, extra_data, outputs, input_data):
     return [
-        calc_lora_hash(model_name, input_data)
+        lazy_lora_hash(model_name, input_data)
         for model_name in get_lora_data_stack(input_data, r"lora_\d_name")
     ]
 
@@ -37,7 +37,7 @@ def get_lora_data_stack(input_data, attribute):
 
 def get_lora_model_hash(node_id, obj, prompt, extra_data, outputs, input_data):
     if input_data[0]["lora_name"][0] != "None":
-        return calc_lora_hash(input_data[0]["lora_name"][0], input_data)
+        return lazy_lora_hash(input_data[0]["lora_name"][0], input_data)
     else:
         return ""
 
@@ -1,6 +1,6 @@
 # https://github.com/rgthree/rgthree-comfy
 from ..meta import MetaField
-from ..formatters import calc_lora_hash
+from ..formatters import lazy_lora_hash
 
 
 def get_lora_model_name(node_id, obj, prompt, extra_data, outputs, input_data):
@@ -9,7 +9,7 @@ def get_lora_model_name(node_id, obj, prompt, extra_data, outputs, input_data):
 
 def get_lora_model_hash(node_id, obj, prompt, extra_data, outputs, input_data):
     return [
-        calc_lora_hash(model_name, input_data)
+        lazy_lora_hash(model_name, input_data)
         for model_name in get_lora_data(input_data, "lora")
     ]
 
@@ -32,7 +32,7 @@ def get_lora_model_name_stack(node_id, obj, prompt, extra_data, outputs, input_d
 
 def get_lora_model_hash_stack(node_id, obj, prompt, extra_data, outputs, input_data):
     return [
-        calc_lora_hash(model_name, input_data)
+        lazy_lora_hash(model_name, input_data)
         for model_name in get_lora_data_stack(input_data, "lora")
     ]
 
@@ -1,8 +1,9 @@
+import functools
 import os
 
 import folder_paths
 
-from ..utils.hash import calc_hash
+from ..utils.hash import LazyHash, calc_hash, get_hash_algorithm
 from ..utils.embedding import get_embedding_file_path
 
 from comfy.sd1_clip import escape_important, token_weights, unescape_important
@@ -12,27 +13,52 @@ from comfy.text_encoders.sd3_clip import SD3Tokenizer
 from comfy.text_encoders.flux import FluxTokenizer
 from comfy.sdxl_clip import SDXLTokenizer
 
-cache_model_hash = {}
 
+def hashes_files(get_paths):
+    """Declares which files a hash formatter will hash, so capture can hash them in parallel first."""
 
+    def decorate(format):
+        format.hash_paths = get_paths
+        return format
+
+    return decorate
+
+
+def _model_paths(folder_name):
+    def get_paths(model_name, input_data):
+        filename = folder_paths.get_full_path(folder_name, model_name)
+        return [filename] if filename is not None else []
+
+    return get_paths
+
+
+@hashes_files(_model_paths("checkpoints"))
 def calc_model_hash(model_name, input_data):
     filename = folder_paths.get_full_path("checkpoints", model_name)
-    return calc_hash(filename)
+    return calc_hash(filename, get_hash_algorithm(checkpoint=True))
 
 
+@hashes_files(_model_paths("vae"))
 def calc_vae_hash(model_name, input_data):
     filename = folder_paths.get_full_path("vae", model_name)
     return calc_hash(filename)
 
 
+@hashes_files(_model_paths("loras"))
 def calc_lora_hash(model_name, input_data):
     filename = folder_paths.get_full_path("loras", model_name)
     return calc_hash(filename)
 
 
+@hashes_files(_model_paths("unet"))
 def calc_unet_hash(model_name, input_data):
     filename = folder_paths.get_full_path("unet", model_name)
-    return calc_hash(filename)
+    return calc_hash(filename, get_hash_algorithm(checkpoint=True))
+
+
+def lazy_lora_hash(model_name, input_data):
+    """calc_lora_hash for selectors: hashed only if the capture needs the hash."""
+    return LazyHash(folder_paths.get_full_path("loras", model_name))
 
 
 def convert_skip_clip(stop_at_clip_layer, input_data):
@@ -55,13 +81,22 @@ def extract_embedding_names(text, input_data):
     return [os.path.basename(embedding_name) for embedding_name in embedding_names]
 
 
+def _embedding_paths(text, input_data):
+    embedding_names, clip = _extract_embedding_names(text, input_data)
+    embedding_file_paths = [
+        get_embedding_file_path(embedding_name, clip) for embedding_name in embedding_names
+    ]
+    return [path for path in embedding_file_paths if path is not None]
+
+
+@hashes_files(_embedding_paths)
 def extract_embedding_hashes(text, input_data):
     embedding_names, clip = _extract_embedding_names(text, input_data)
     embedding_hashes = []
     for embedding_name in embedding_names:
         embedding_file_path = get_embedding_file_path(embedding_name, clip)
         if embedding_file_path is not None:
-            embedding_hashes.append(calc_hash(embedding_file_path))
+            embedding_hashes.append(LazyHash(embedding_file_path))
         else:
             print(f"Warning: Embedding file not found for '{embedding_name}'")
 
@@ -72,8 +107,10 @@ def _extract_embedding_names(text, input_data):
     embedding_identifier = "embedding:"
     clip_ = input_data[0]["clip"][0]
     clip = None
+    tokenizer_type = None
     if clip_ is not None:
         tokenizer = clip_.tokenizer
+        tokenizer_type = type(tokenizer)
         if isinstance(tokenizer, SD1Tokenizer):
             clip = tokenizer.clip
         elif isinstance(tokenizer, SD2Tokenizer):
@@ -88,6 +125,20 @@ def _extract_embedding_names(text, input_data):
             embedding_identifier = clip.embedding_identifier
     if not isinstance(text, str):
         text = "".join(str(item) if item is not None else "" for item in text)
+    has_embedding_directory = clip is not None and clip.embedding_directory is not None
+
+    # extract_embedding_names and extract_embedding_hashes share one parse per text
+    embedding_names = _parse_embedding_names(
+        text, tokenizer_type, embedding_identifier, has_embedding_directory
+    )
+    return list(embedding_names), clip
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_embedding_names(text, tokenizer_type, embedding_identifier, has_embedding_directory):
+    if not has_embedding_directory:
+        return ()
+
     text = escape_important(text)
     parsed_weights = token_weights(text, 1.0)
 
@@ -98,11 +149,8 @@ def _extract_embedding_names(text, input_data):
         to_tokenize = [x for x in to_tokenize if x != ""]
         for word in to_tokenize:
             # find an embedding, deal with the embedding
-            if (
-                word.startswith(embedding_identifier)
-                and clip.embedding_directory is not None
-            ):
+            if word.startswith(embedding_identifier):
                 embedding_name = word[len(embedding_identifier) :].strip("\n").strip(",")
                 embedding_names.append(embedding_name)
 
-    return embedding_names, clip
+    return tuple(embedding_names)
@@ -0,0 +1,135 @@
+from typing import Callable, NamedTuple, Optional
+
+from .meta import MetaField
+from ..utils.hash import LazyHash
+
+# metas whose selectors may return LazyHash values
+HASH_META_FIELDS = frozenset(
+    (MetaField.MODEL_HASH, MetaField.VAE_HASH, MetaField.EMBEDDING_HASH, MetaField.LORA_MODEL_HASH)
+)
+
+
+class CaptureField(NamedTuple):
+    meta: int
+    field_name: Optional[str]
+    is_hash: bool
+    extract: Callable
+    # for hash fields: same signature as extract, returns the files the field will hash
+    collect_hash_paths: Optional[Callable] = None
+
+
+def compile_capture_plans(capture_field_list):
+    """
+    Compiles each class_type entry of CAPTURE_FIELD_LIST into a tuple of CaptureField.
+
+    Every extractor has the signature
+    (node_id, display_node_id, node_obj, prompt, extra_data, outputs, input_data, index, calc_model_hash)
+    and returns the list of captured values. LazyHash values are resolved only when
+    calc_model_hash is set, and are None otherwise.
+    """
+    return {
+        class_type: tuple(
+            _compile_field(meta, field_data) for meta, field_data in metas.items()
+        )
+        for class_type, metas in capture_field_list.items()
+    }
+
+
+def _compile_field(meta, field_data):
+    value = field_data.get("value")
+    selector = field_data.get("selector")
+    format = field_data.get("format")
+    field_name = None
+    is_hash = False
+    collect_hash_paths = None
+
+    if value is not None:
+        extract = _value_extractor(value)
+    elif selector is not None:
+        extract = _selector_extractor(selector)
+        if meta in HASH_META_FIELDS:
+            collect_hash_paths = _selector_hash_paths(selector)
+    else:
+        field_name = field_data["field_name"]
+        # formatのメソッド名が「_hash」で終わる場合、calc_model_hashがFalseならメソッドを呼び出さずNoneにする
+        is_hash = format is not None and format.__name__.endswith("_hash")
+        extract = _field_extractor(field_name, format, is_hash)
+        if hasattr(format, "hash_paths"):
+            collect_hash_paths = _field_extractor(field_name, format.hash_paths, False)
+
+    validate = field_data.get("validate")
+    if validate is not None:
+        extract = _validated_extractor(validate, extract)
+
+    return CaptureField(meta, field_name, is_hash, extract, collect_hash_paths)
+
+
+def _value_extractor(value):
+    values = (value,)
+
+    def extract(node_id, display_node_id, node_obj, prompt, extra_data, outputs, input_data, index, calc_model_hash):
+        return values
+
+    return extract
+
+
+def _selector_extractor(selector):
+    def extract(node_id, display_node_id, node_obj, prompt, extra_data, outputs, input_data, index, calc_model_hash):
+        v = selector(node_id, node_obj, prompt, extra_data, outputs, input_data)
+        if isinstance(v, list):
+            return _resolve_lazy_hashes(v, calc_model_hash)
+        if v is None:
+            return ()
+        return _resolve_lazy_hashes((v,), calc_model_hash)
+
+    return extract
+
+
+def _selector_hash_paths(selector):
+    def collect(node_id, display_node_id, node_obj, prompt, extra_data, outputs, input_data, index, calc_model_hash):
+        v = selector(node_id, node_obj, prompt, extra_data, outputs, input_data)
+        values = v if isinstance(v, list) else (v,)
+        return [value.filename for value in values if isinstance(value, LazyHash) and value.filename]
+
+    return collect
+
+
+def _field_extractor(field_name, format, is_hash):
+    def extract(node_id, display_node_id, node_obj, prompt, extra_data, outputs, input_data, index, calc_model_hash):
+        value = input_data[0].get(field_name)
+        if value is None:
+            return ()
+
+        if isinstance(value, list) and len(value) > 0:
+            v = value[index] if len(value) > index else value[0]
+        else:
+            v = value
+
+        if is_hash and not calc_model_hash:
+            v = None
+        elif format is not None:
+            v = format(v, input_data)
+
+        if isinstance(v, list):
+            return _resolve_lazy_hashes(v, calc_model_hash)
+        return _resolve_lazy_hashes((v,), calc_model_hash)
+
+    return extract
+
+
+def _resolve_lazy_hashes(values, calc_model_hash):
+    if not any(isinstance(v, LazyHash) for v in values):
+        return values
+    return [
+        (v.resolve() if calc_model_hash else None) if isinstance(v, LazyHash) else v
+        for v in values
+    ]
+
+
+def _validated_extractor(validate, extract):
+    def validated(node_id, display_node_id, node_obj, prompt, extra_data, outputs, input_data, index, calc_model_hash):
+        if not validate(display_node_id, node_obj, prompt, extra_data, outputs, input_data):
+            return ()
+        return extract(node_id, display_node_id, node_obj, prompt, extra_data, outputs, input_data, index, calc_model_hash)
+
+    return validated
@@ -2,6 +2,7 @@ from collections import deque
 
 from .samplers import SAMPLERS
 from .textencodes import TEXT_ENCODE_CLASSES
+from ..utils.prompt_cache import memoize_on_prompt
 
 
 def is_positive_prompt(node_id, obj, prompt, extra_data, outputs, input_data_all):
@@ -13,23 +14,46 @@ def is_negative_prompt(node_id, obj, prompt, extra_data, outputs, input_data_all
 
 
 def _get_node_id_list(prompt, field_name):
-    node_id_list = {}
+    return memoize_on_prompt("text_encode_index", prompt, _build_text_encode_index)[
+        field_name
+    ]
+
+
+def _build_text_encode_index(prompt):
+    # sampler node id -> text encode node id, per conditioning field
+    index = {"positive": {}, "negative": {}}
     for nid, node in prompt.items():
-        for sampler_type, field_map in SAMPLERS.items():
-            if node["class_type"] == sampler_type:
-                # There are nodes between "KSampler" and "CLIP Text Encode" in the SD3 workflow
-                d = deque()
-                if field_name in field_map and field_map[field_name] in node["inputs"]:
-                    d.append(node["inputs"][field_map[field_name]][0])
-                while len(d) > 0:
-                    nid2 = d.popleft()
-                    class_type = prompt[nid2]["class_type"]
-                    if class_type in TEXT_ENCODE_CLASSES:
-                        node_id_list[nid] = nid2
-                        break
-                    inputs = prompt[nid2]["inputs"]
-                    for k, v in inputs.items():
-                        if isinstance(v, list):
-                            d.append(v[0])
-
-    return node_id_list.values()
+        field_map = SAMPLERS.get(node["class_type"])
+        if field_map is None:
+            continue
+        for field_name, node_id_list in index.items():
+            if field_name in field_map and field_map[field_name] in node["inputs"]:
+                encoder_id = _find_text_encode(
+                    prompt, node["inputs"][field_map[field_name]][0]
+                )
+                if encoder_id is not None:
+                    node_id_list[nid] = encoder_id
+
+    return {
+        field_name: set(node_id_list.values())
+        for field_name, node_id_list in index.items()
+    }
+
+
+def _find_text_encode(prompt, start_node_id):
+    # There are nodes between "KSampler" and "CLIP Text Encode" in the SD3 workflow
+    d = deque([start_node_id])
+    visited = {start_node_id}
+    while len(d) > 0:
+        nid = d.popleft()
+        node = prompt.get(nid)
+        if node is None:
+            continue
+        if node["class_type"] in TEXT_ENCODE_CLASSES:
+            return nid
+        for v in node["inputs"].values():
+            if isinstance(v, list) and v[0] not in visited:
+                visited.add(v[0])
+                d.append(v[0])
+
+    return None
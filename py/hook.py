@@ -1,29 +1,93 @@
 from .nodes.node import SendToEagleWithMetadataFull, SendToEagleWithMetadataSimple
+from .defs import CAPTURE_PLANS
+from .utils.env import env_flag
+from .utils.save_queue import save_queue, wait_for_saves
 
 current_prompt = {}
+current_prompt_id = None
 current_extra_data = {}
 prompt_executer = None
 current_full_node_id = -1
 current_simple_node_id = -1
+current_save_node_id = -1
+
+# Opt-in: keep the inputs resolved while the capturable nodes execute, so the save
+# node can read them instead of calling get_input_data a second time.
+record_inputs = env_flag("EAGLE_RECORD_INPUTS")
+recorded_inputs = {}  # prompt_id -> {unique_id: result of get_input_data}, while the prompt runs
+_capture_classes = set()
 
 
 def pre_execute(self, prompt, prompt_id, extra_data, execute_outputs):
     global current_prompt
+    global current_prompt_id
     global current_extra_data
     global prompt_executer
+    global _capture_classes
 
     current_prompt = prompt
+    current_prompt_id = prompt_id
     current_extra_data = extra_data
     prompt_executer = self
 
+    if record_inputs:
+        # only the running prompt is needed; drop the recordings of earlier prompts
+        recorded_inputs.clear()
+        recorded_inputs[prompt_id] = {}
+        _capture_classes = _get_capture_classes()
+
+
+def post_execute(result, self, prompt, prompt_id, *args):
+    # the recorded inputs hold the models, conditioning and images of the prompt; release
+    # them once it has run instead of keeping them until the next prompt
+    recorded_inputs.pop(prompt_id, None)
+
 
 def pre_get_input_data(inputs, class_def, unique_id, *args):
     global current_full_node_id
     global current_simple_node_id
+    global current_save_node_id
 
     if class_def == SendToEagleWithMetadataFull:
         current_full_node_id = unique_id
+        current_save_node_id = unique_id
     elif class_def == SendToEagleWithMetadataSimple:
         current_simple_node_id = unique_id
+        current_save_node_id = unique_id
+
+    if save_queue is not None:
+        wait_for_filepath_inputs(inputs)
+
+
+def wait_for_filepath_inputs(inputs):
+    # a node reading the filepath output of a save node needs the files written in the background
+    for value in inputs.values():
+        if isinstance(value, list) and len(value) == 2 and value[1] == 0:
+            wait_for_saves(value[0])
+
+
+def post_get_input_data(result, inputs, class_def, unique_id, *args):
+    if not record_inputs or class_def not in _capture_classes:
+        return
+
+    recordings = recorded_inputs.get(current_prompt_id)
+    if recordings is not None:
+        recordings[unique_id] = result
+
+
+def get_recorded_inputs(unique_id):
+    recordings = recorded_inputs.get(current_prompt_id)
+    if recordings is None:
+        return None
+    return recordings.get(unique_id)
+
 
+def _get_capture_classes():
+    # resolved at execution time because other custom nodes register after this extension loads
+    from nodes import NODE_CLASS_MAPPINGS
 
+    return {
+        NODE_CLASS_MAPPINGS[class_type]
+        for class_type in CAPTURE_PLANS
+        if class_type in NODE_CLASS_MAPPINGS
+    }
@@ -1,8 +1,9 @@
-import json
+import functools
 import os
 import re
 
 from datetime import datetime
+from typing import Any, NamedTuple, Optional
 from zoneinfo import ZoneInfo
 
 from PIL import Image
@@ -15,12 +16,39 @@ import piexif.helper
 import folder_paths
 from comfy.cli_args import args
 
-from ..capture import Capture
+from ..capture import Capture, PngInfoSnapshot
 from .. import hook
-from ..trace import Trace
+from ..trace import Trace, TraceIndex
 
 from ..defs.combo import SAMPLER_SELECTION_METHOD, TAG_PATTERN
 from ..utils.eagle_api import EagleAPI
+from ..utils.hash import defer_hashes
+from ..utils.deferred_hash import collect_pending_hashes, deferred_hash_queue, without_pending_hashes
+from ..utils.save_queue import BatchCounters, save_queue
+from ..utils.encode_pool import ENCODE_MIN_BATCH, encode_pool
+from ..utils.env import env_int
+from ..utils.metadata_cache import get_metadata_chunks
+
+# frames converted and encoded together; long image lists are streamed in chunks of this size
+STREAM_CHUNK_SIZE = max(1, env_int("EAGLE_STREAM_CHUNK_SIZE", 16))
+
+class SaveJob(NamedTuple):
+    """Everything needed to write one image and send it to Eagle, prepared by send_to_eagle."""
+
+    img: Any
+    pixels: Any
+    file_path: str
+    file_format: str
+    quality: int
+    lossless_webp: bool
+    parameters: str
+    extra_pnginfo: Optional[dict]
+    prompt: Optional[dict]
+    workflow_json_path: Optional[str]
+    item: Optional[dict]
+    folder_id: Optional[str]
+    pending_hashes: dict
+
 
 class BaseNode:
     CATEGORY = "SendToEagle"
@@ -48,6 +76,9 @@ class SendToEagleWithMetadata(BaseNode):
 
     pattern_format = re.compile(r"(%[^%]+%)")
 
+    # metadata fields that create_tags reads by name (computed on demand from the lazy PNGInfo)
+    TAG_METADATA_FIELDS = ("Steps", "Sampler", "CFG scale", "Seed", "Clip skip", "Size", "Model", "Model hash", "VAE", "VAE hash", "Batch index", "Batch size")
+
     def send_to_eagle(
         self,
         images,
@@ -112,8 +143,8 @@ class SendToEagleWithMetadata(BaseNode):
         prompt = self._unwrap_to_value(prompt)
         extra_pnginfo = self._unwrap_to_value(extra_pnginfo)
 
-        image_tensors = self._flatten_image_batch(images)
-        if not image_tensors:
+        batch_size = self._count_images(images)
+        if batch_size == 0:
             return ([], 0, images,)
 
         positive_prompts = self._normalize_prompt_input(positive)
@@ -125,24 +156,36 @@ class SendToEagleWithMetadata(BaseNode):
 
         results = []
         file_path_list = []
-        batch_size = len(image_tensors)
-        primary_image = image_tensors[0]
+        primary_shape = self._get_primary_image_shape(images)
 
         folder_id_cache = {}
 
-        for index, image in enumerate(image_tensors):
-            image_array = image.cpu().numpy() if hasattr(image, "cpu") else np.asarray(image)
-            i = 255.0 * image_array
-            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-
-            pnginfo_dict = self.gen_pnginfo(
-                sampler_selection_method,
-                sampler_selection_node_id,
-                civitai_sampler,
-                calc_model_hash,
-                index,
-                include_prompts=use_workflow_prompts,
-            )
+        # send now and let the deferred hash queue patch the hashes into the Eagle items later
+        defer_hash = calc_model_hash and not save_only_no_send and deferred_hash_queue is not None
+
+        # large batches are encoded on the process pool, one chunk of frames at a time
+        use_encode_pool = encode_pool is not None and batch_size >= ENCODE_MIN_BATCH
+        save_jobs = []
+        reservations = []
+        batch_counters = BatchCounters(save_queue)
+
+        pnginfo_snapshot = self.gen_pnginfo_snapshot(
+            sampler_selection_method,
+            sampler_selection_node_id,
+            civitai_sampler,
+            calc_model_hash,
+            include_prompts=use_workflow_prompts,
+        )
+
+        # frames are converted chunk by chunk, so memory stays flat however long the image list is
+        for index, pixels in enumerate(self._iter_image_batch(images, STREAM_CHUNK_SIZE)):
+            img = None if use_encode_pool else Image.fromarray(pixels)
+
+            pnginfo_dict = pnginfo_snapshot.gen_pnginfo_dict(index)
+            if defer_hash:
+                # files that are not hashed yet get placeholder hashes
+                with defer_hashes():
+                    pnginfo_dict = pnginfo_dict.to_dict()
 
             #pnginfo_dict = pnginfo_dict_src.copy()
             extra_metadata_value = self._select_batch_value(extra_metadata_source, index, {})
@@ -169,7 +212,20 @@ class SendToEagleWithMetadata(BaseNode):
             if apply_negative:
                 pnginfo_dict["Negative prompt"] = negative_value
 
-            parameters = Capture.gen_parameters_str(pnginfo_dict)
+            pending_hashes = collect_pending_hashes(pnginfo_dict) if defer_hash else {}
+
+            # fields are computed on demand, so skip the full parameters string when nothing writes it
+            send_parameters = not save_only_no_send and send_metadata_as_memo
+            if file_format != "png" or not args.disable_metadata or send_parameters:
+                parameters = Capture.gen_parameters_str(pnginfo_dict)
+            else:
+                parameters = ""
+            # placeholder hashes only go to Eagle, where the deferred hash queue replaces them
+            file_parameters = parameters
+            if pending_hashes and parameters:
+                file_parameters = Capture.gen_parameters_str(
+                    without_pending_hashes(pnginfo_dict, pending_hashes)
+                )
             filename_prefix_value = self._select_batch_value(
                 filename_prefix_source, index, default_filename_prefix
             )
@@ -188,9 +244,11 @@ class SendToEagleWithMetadata(BaseNode):
             ) = folder_paths.get_save_image_path(
                 formatted_filename_prefix,
                 self.output_dir,
-                primary_image.shape[1],
-                primary_image.shape[0],
+                primary_shape[1],
+                primary_shape[0],
             )
+            if add_counter_to_filename:
+                counter = batch_counters.next(full_output_folder, filename, counter)
             base_filename = filename
             if add_counter_to_filename:
                 base_filename += f"_{counter:05}_"
@@ -201,30 +259,14 @@ class SendToEagleWithMetadata(BaseNode):
             file_name = base_filename + "." + ("jpg" if file_format == "jpeg" else file_format)
             file_path = os.path.join(full_output_folder, file_name)
 
-            if file_format == "png":
-                metadata = self.create_pnginfo(parameters, extra_pnginfo, prompt)                
-                img.save(
-                    file_path,
-                    pnginfo=metadata,
-                    compress_level=self.compress_level,
-                )
-            else:
-                exif_bytes = self.create_exif_bytes(img, parameters, extra_pnginfo, prompt)
-                img.save(
-                    file_path,
-                    optimize=True,
-                    quality=quality,
-                    lossless=lossless_webp,
-                    exif=exif_bytes,
-                )
-
+            workflow_json_path = None
             if save_workflow_json:
-                file_path_workflow = os.path.join(
+                workflow_json_path = os.path.join(
                     full_output_folder, f"{base_filename}.json"
                 )
-                with open(file_path_workflow, "w", encoding="utf-8") as f:
-                    json.dump(extra_pnginfo["workflow"], f)
 
+            item = None
+            folder_id = None
             if not save_only_no_send:
                 # Eagleフォルダが指定されているならフォルダIDを取得
                 eagle_folder_value = self._select_batch_value(eagle_folder_source, index, "")
@@ -264,8 +306,44 @@ class SendToEagleWithMetadata(BaseNode):
                     ),
                 }
 
-                # Eagleに送る
-                self.eagle_api.add_item_from_url(data=item, folder_id=folder_id)
+            save_job = SaveJob(
+                img,
+                pixels if use_encode_pool else None,
+                file_path,
+                file_format,
+                quality,
+                lossless_webp,
+                file_parameters,
+                extra_pnginfo,
+                prompt,
+                workflow_json_path,
+                item,
+                folder_id,
+                pending_hashes,
+            )
+            reservation = ()
+            if save_queue is not None and add_counter_to_filename:
+                reservation = (((full_output_folder, filename), counter),)
+
+            if use_encode_pool:
+                save_jobs.append(save_job)
+                reservations.extend(reservation)
+                if len(save_jobs) >= STREAM_CHUNK_SIZE:
+                    self._submit_save_batch(save_jobs, reservations)
+                    save_jobs = []
+                    reservations = []
+            elif save_queue is not None:
+                # encoding, writing and sending run in the background; downstream nodes that
+                # read filepath wait for them (see hook.pre_get_input_data)
+                save_queue.submit(
+                    hook.current_save_node_id,
+                    self.save,
+                    save_job,
+                    then=functools.partial(self.send, save_job),
+                    reservations=reservation,
+                )
+            else:
+                self.save_and_send(save_job)
 
             results.append(
                 {"filename": file_name, "subfolder": subfolder, "type": self.type}
@@ -273,8 +351,74 @@ class SendToEagleWithMetadata(BaseNode):
             file_path_list.append(file_path)
             counter += 1
 
+        if save_jobs:
+            self._submit_save_batch(save_jobs, reservations)
+
         return (file_path_list, len(file_path_list), images,)
 
+    def _submit_save_batch(self, save_jobs, reservations):
+        if save_queue is not None:
+            # Eagle items are added in submission order, whichever batch is written first
+            save_queue.submit(
+                hook.current_save_node_id,
+                self.save_batch,
+                save_jobs,
+                then=functools.partial(self.send_batch, save_jobs),
+                reservations=reservations,
+            )
+        else:
+            self.save_batch(save_jobs)
+            self.send_batch(save_jobs)
+
+    def save_and_send(self, job):
+        self.save(job)
+        self.send(job)
+
+    def save(self, job):
+        job.img.save(job.file_path, **self.create_save_kwargs(job))
+        self.write_workflow(job)
+
+    def save_batch(self, jobs):
+        """Encodes the batch on the process pool."""
+        encode_pool.encode(
+            [(job.pixels, job.file_path, self.create_save_kwargs(job)) for job in jobs]
+        )
+        for job in jobs:
+            self.write_workflow(job)
+
+    def send_batch(self, jobs):
+        for job in jobs:
+            self.send(job)
+
+    def create_save_kwargs(self, job):
+        if job.file_format == "png":
+            return {
+                "pnginfo": self.create_pnginfo(job.parameters, job.extra_pnginfo, job.prompt),
+                "compress_level": self.compress_level,
+            }
+        return {
+            "optimize": True,
+            "quality": job.quality,
+            "lossless": job.lossless_webp,
+            "exif": self.create_exif_bytes(job.img, job.parameters, job.extra_pnginfo, job.prompt),
+        }
+
+    def write_workflow(self, job):
+        if job.workflow_json_path is not None:
+            workflow_json = get_metadata_chunks(job.prompt, job.extra_pnginfo).extra_json["workflow"]
+            with open(job.workflow_json_path, "w", encoding="utf-8") as f:
+                f.write(workflow_json)
+
+    def send(self, job):
+        if job.item is not None:
+            # Eagleに送る
+            response = self.eagle_api.add_item_from_url(data=job.item, folder_id=job.folder_id)
+
+            if job.pending_hashes:
+                deferred_hash_queue.add(
+                    job.item["name"], job.item["annotation"], job.item["tags"], job.pending_hashes, response
+                )
+
     @classmethod
     def gen_pnginfo(
         cls,
@@ -285,37 +429,57 @@ class SendToEagleWithMetadata(BaseNode):
         index,
         include_prompts=True,
     ):
-        # get all node inputs
-        inputs = Capture.get_inputs(calc_model_hash, index, include_prompts)
+        pnginfo_snapshot = cls.gen_pnginfo_snapshot(
+            sampler_selection_method,
+            sampler_selection_node_id,
+            save_civitai_sampler,
+            calc_model_hash,
+            include_prompts,
+        )
+        return pnginfo_snapshot.gen_pnginfo_dict(index)
 
+    @classmethod
+    def gen_pnginfo_snapshot(
+        cls,
+        sampler_selection_method,
+        sampler_selection_node_id,
+        save_civitai_sampler,
+        calc_model_hash,
+        include_prompts=True,
+    ):
         # get sampler node before this node
         if cls.__name__ == "SendToEagleWithMetadataFull":
             current_node_id = hook.current_full_node_id
         elif cls.__name__ == "SendToEagleWithMetadataSimple":
             current_node_id = hook.current_simple_node_id
-        trace_tree_from_this_node = Trace.trace(
-            current_node_id, hook.current_prompt
-        )
-        inputs_before_this_node = Trace.filter_inputs_by_trace_tree(
-            inputs, trace_tree_from_this_node
-        )
+        trace_index = TraceIndex.for_prompt(hook.current_prompt)
+        trace_tree_from_this_node = trace_index.trace(current_node_id)
         sampler_node_id = Trace.find_sampler_node_id(
             trace_tree_from_this_node,
             sampler_selection_method,
             sampler_selection_node_id,
+            trace_index,
         )
 
         # get inputs before sampler node
-        trace_tree_from_sampler_node = Trace.trace(sampler_node_id, hook.current_prompt)
-        inputs_before_sampler_node = Trace.filter_inputs_by_trace_tree(
-            inputs, trace_tree_from_sampler_node
+        trace_tree_from_sampler_node = trace_index.trace(sampler_node_id)
+
+        # get inputs of the nodes before this node (once per execution, projected per batch index later)
+        capture_snapshot = Capture.snapshot(
+            calc_model_hash,
+            include_prompts,
+            trace_tree_from_this_node,
+            trace_index,
         )
 
-        # generate PNGInfo from inputs
-        pnginfo_dict = Capture.gen_pnginfo_dict(
-            inputs_before_sampler_node, inputs_before_this_node, save_civitai_sampler, calc_model_hash
+        return PngInfoSnapshot(
+            capture_snapshot,
+            trace_tree_from_this_node,
+            trace_tree_from_sampler_node,
+            save_civitai_sampler,
+            calc_model_hash,
+            trace_index,
         )
-        return pnginfo_dict
 
     def format_filename(self, filename, pnginfo_dict):
         result = re.findall(self.pattern_format, filename)
@@ -471,26 +635,58 @@ class SendToEagleWithMetadata(BaseNode):
         return source
 
     @classmethod
-    def _flatten_image_batch(cls, images):
-        flattened = []
+    def _iter_image_batch(cls, images, chunk_size):
+        """
+        Yields every image of the IMAGE inputs as a uint8 HxWxC numpy array.
+
+        Frames are scaled, clamped and converted to uint8 chunk_size at a time on their own
+        device, so the host copy is a quarter of the float32 size and no per-image float
+        temporaries are made. The yielded images are views into their converted chunk.
+        """
+        for batch in cls._iter_image_batches(images):
+            for start in range(0, batch.shape[0], chunk_size):
+                yield from cls._quantize_image_batch(batch[start:start + chunk_size])
 
-        def _collect(item):
-            if item is None:
-                return
-            if isinstance(item, (list, tuple)):
-                for sub_item in item:
-                    _collect(sub_item)
+    @classmethod
+    def _iter_image_batches(cls, images):
+        """Yields the IMAGE inputs as NxHxWxC batches without converting them."""
+        if images is None:
+            return
+        if isinstance(images, (list, tuple)):
+            for item in images:
+                yield from cls._iter_image_batches(item)
+            return
+        if hasattr(images, "shape") and len(images.shape) >= 4:
+            if len(images.shape) > 4:
+                for idx in range(images.shape[0]):
+                    yield from cls._iter_image_batches(images[idx])
                 return
-            if hasattr(item, "shape"):
-                shape_len = len(item.shape)
-                if shape_len >= 4:
-                    for idx in range(item.shape[0]):
-                        _collect(item[idx])
-                    return
-            flattened.append(item)
+            yield images
+            return
+        image = images if hasattr(images, "shape") else np.asarray(images)
+        yield image[None]
+
+    @classmethod
+    def _count_images(cls, images):
+        return sum(batch.shape[0] for batch in cls._iter_image_batches(images))
+
+    @classmethod
+    def _get_primary_image_shape(cls, images):
+        for batch in cls._iter_image_batches(images):
+            if batch.shape[0] > 0:
+                return tuple(batch.shape[1:])
+        return None
 
-        _collect(images)
-        return flattened
+    @staticmethod
+    def _quantize_image_batch(batch):
+        # same result as np.clip(255.0 * image, 0, 255).astype(np.uint8) per image
+        if hasattr(batch, "cpu"):
+            quantized = batch.mul(255.0).clamp_(0, 255).byte().cpu().numpy()
+        else:
+            quantized = np.multiply(batch, 255.0)
+            np.clip(quantized, 0, 255, out=quantized)
+            quantized = quantized.astype(np.uint8)
+        return list(quantized)
 
     @classmethod
     def create_tags(cls, tag_pattern, custom_tag_pattern, memo, extra_metadata, pnginfo_dict) -> list:
@@ -513,7 +709,7 @@ class SendToEagleWithMetadata(BaseNode):
                 results.extend(cls.create_prompt_tags(pnginfo_dict.get(tag, "")))
             elif tag == "Negative prompt":
                 results.extend(cls.create_prompt_tags(pnginfo_dict.get(tag, ""), "n:"))
-            elif tag in ("Steps", "Sampler", "CFG scale", "Seed", "Clip skip", "Size", "Model", "Model hash", "VAE", "VAE hash", "Batch index", "Batch size"):
+            elif tag in cls.TAG_METADATA_FIELDS:
                 results.append(f"{tag}: " + str(pnginfo_dict.get(tag, "-")))
             elif tag in extra_metadata and extra_metadata[tag]:
                 results.append(f"{tag}: " + str(extra_metadata[tag]))
@@ -553,20 +749,19 @@ class SendToEagleWithMetadata(BaseNode):
 
     @classmethod
     def create_exif_bytes(cls, img, parameters, extra_pnginfo, prompt):
-        metadata = img.getexif()
+        # img is None when the image is encoded in another process
+        metadata = img.getexif() if img is not None else {}
 
-        if len(metadata) == 0:
-            metadata = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}}
+        # prompt and extra_pnginfo are serialized once per execution
+        metadata_chunks = get_metadata_chunks(prompt, extra_pnginfo)
+        user_comment = piexif.helper.UserComment.dump(parameters, "unicode")
 
-        if prompt is not None:
-            metadata["0th"][0x0110] = "prompt:{}".format(json.dumps(prompt))
-        if extra_pnginfo is not None:
-            inital_exif = 0x010f
-            for x in extra_pnginfo:
-                metadata["0th"][inital_exif] = "{}:{}".format(x, json.dumps(extra_pnginfo[x]))
-                inital_exif -= 1
+        if len(metadata) == 0:
+            # only the UserComment differs between the images, so the IFDs are dumped once
+            return metadata_chunks.exif_bytes(user_comment)
 
-        metadata["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(parameters, "unicode")
+        metadata["0th"].update(metadata_chunks.exif_0th)
+        metadata["Exif"][piexif.ExifIFD.UserComment] = user_comment
 
         return piexif.dump(metadata)
 
@@ -578,11 +773,8 @@ class SendToEagleWithMetadata(BaseNode):
             metadata = PngInfo()
             if parameters:
                 metadata.add_text("parameters", parameters)
-            if prompt is not None:
-                metadata.add_text("prompt", json.dumps(prompt))
-            if extra_pnginfo is not None:
-                for x in extra_pnginfo:
-                    metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+            # prompt and extra_pnginfo chunks are encoded once per execution and shared
+            metadata.chunks.extend(get_metadata_chunks(prompt, extra_pnginfo).png_chunks)
 
         return metadata
 
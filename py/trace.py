@@ -2,110 +2,137 @@ from collections import deque
 
 from .defs.samplers import SAMPLERS
 from .defs.combo import SAMPLER_SELECTION_METHOD
+from .utils.prompt_cache import memoize_on_prompt
 
 
-class Trace:
-    @staticmethod
-    def _resolve_node_id(node_id, prompt):
-        if node_id is None:
-            return None
+class TraceIndex:
+    """Upstream graph of one prompt, with memoized node-id resolution and distances."""
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self._candidates = {}
+        self._resolved = {}
+        self._adjacency = {}
+        self._trace_trees = {}
+
+    @classmethod
+    def for_prompt(cls, prompt):
+        return memoize_on_prompt("trace_index", prompt, cls)
+
+    def candidates(self, node_id):
+        """Keys that may stand for node_id, in resolution order."""
+        candidates = self._candidates.get(node_id)
+        if candidates is not None:
+            return candidates
 
         candidate = str(node_id)
-        if candidate in prompt:
-            return candidate
+        candidates = [node_id]
+        if candidate != node_id:
+            candidates.append(candidate)
 
         # ComfyUI's For Loop nodes append iteration metadata to the unique id.
         # Walk prefixes (dropping the deepest segments) to locate the actual node id.
         parts = candidate.split(".")
         if len(parts) > 1:
             for i in range(len(parts) - 1, 0, -1):
-                prefix = ".".join(parts[:i])
-                if prefix in prompt:
-                    return prefix
+                candidates.append(".".join(parts[:i]))
 
             for i in range(len(parts) - 1, 0, -1):
-                suffix = ".".join(parts[-i:])
-                if suffix in prompt:
-                    return suffix
+                candidates.append(".".join(parts[-i:]))
 
         if candidate.isdigit():
-            numeric_key = int(candidate)
-            if numeric_key in prompt:
-                return numeric_key
+            candidates.append(int(candidate))
 
-        return None
+        candidates = tuple(candidates)
+        self._candidates[node_id] = candidates
+        return candidates
 
-    @staticmethod
-    def _resolve_node_id_in_trace(node_id, trace_tree):
+    def resolve(self, node_id):
         if node_id is None:
             return None
 
-        if node_id in trace_tree:
-            return node_id
+        if node_id in self._resolved:
+            return self._resolved[node_id]
 
-        candidate = str(node_id)
-        if candidate in trace_tree:
-            return candidate
+        resolved = self.resolve_in(node_id, self.prompt)
+        self._resolved[node_id] = resolved
+        return resolved
 
-        parts = candidate.split(".")
-        if len(parts) > 1:
-            for i in range(len(parts) - 1, 0, -1):
-                prefix = ".".join(parts[:i])
-                if prefix in trace_tree:
-                    return prefix
+    def resolve_in(self, node_id, keys):
+        if node_id is None:
+            return None
 
-            for i in range(len(parts) - 1, 0, -1):
-                suffix = ".".join(parts[-i:])
-                if suffix in trace_tree:
-                    return suffix
+        for candidate in self.candidates(node_id):
+            if candidate in keys:
+                return candidate
+        return None
 
-        if candidate.isdigit():
-            numeric_key = int(candidate)
-            if numeric_key in trace_tree:
-                return numeric_key
+    def upstream(self, node_id):
+        adjacency = self._adjacency.get(node_id)
+        if adjacency is not None:
+            return adjacency
 
-        return None
+        adjacency = []
+        prompt_node = self.prompt.get(node_id)
+        if prompt_node is not None:
+            for value in prompt_node.get("inputs", {}).values():
+                if isinstance(value, list) and len(value) > 0:
+                    resolved_nid = self.resolve(value[0])
+                    if resolved_nid is not None and self.prompt.get(resolved_nid) is not None:
+                        adjacency.append(resolved_nid)
 
-    @classmethod
-    def trace(cls, start_node_id, prompt):
-        resolved_start_id = cls._resolve_node_id(start_node_id, prompt)
-        if resolved_start_id is None or resolved_start_id not in prompt:
+        adjacency = tuple(adjacency)
+        self._adjacency[node_id] = adjacency
+        return adjacency
+
+    def trace(self, start_node_id):
+        resolved_start_id = self.resolve(start_node_id)
+        if resolved_start_id is None or resolved_start_id not in self.prompt:
             return {}
 
+        trace_tree = self._trace_trees.get(resolved_start_id)
+        if trace_tree is not None:
+            return trace_tree
+
         trace_tree = {}
         queue = deque()
-        start_class_type = prompt[resolved_start_id]["class_type"]
+        start_class_type = self.prompt[resolved_start_id]["class_type"]
         trace_tree[resolved_start_id] = (0, start_class_type)
         queue.append((resolved_start_id, 0))
 
         while queue:
             current_node_id, distance = queue.popleft()
-            prompt_node = prompt.get(current_node_id)
-            if prompt_node is None:
-                continue
+            for resolved_nid in self.upstream(current_node_id):
+                if resolved_nid in trace_tree:
+                    continue
 
-            input_fields = prompt_node.get("inputs", {})
-            for value in input_fields.values():
-                if isinstance(value, list) and len(value) > 0:
-                    raw_nid = value[0]
-                    resolved_nid = cls._resolve_node_id(raw_nid, prompt)
-                    if resolved_nid is None or resolved_nid in trace_tree:
-                        continue
+                class_type = self.prompt[resolved_nid].get("class_type")
+                trace_tree[resolved_nid] = (distance + 1, class_type)
+                queue.append((resolved_nid, distance + 1))
 
-                    child_node = prompt.get(resolved_nid)
-                    if child_node is None:
-                        continue
+        self._trace_trees[resolved_start_id] = trace_tree
+        return trace_tree
 
-                    class_type = child_node.get("class_type")
-                    trace_tree[resolved_nid] = (distance + 1, class_type)
-                    queue.append((resolved_nid, distance + 1))
 
-        return trace_tree
+class Trace:
+    @staticmethod
+    def _resolve_node_id(node_id, prompt):
+        return TraceIndex.for_prompt(prompt).resolve(node_id)
+
+    @staticmethod
+    def _resolve_node_id_in_trace(node_id, trace_tree, trace_index=None):
+        if trace_index is None:
+            trace_index = TraceIndex({})
+        return trace_index.resolve_in(node_id, trace_tree)
+
+    @classmethod
+    def trace(cls, start_node_id, prompt):
+        return TraceIndex.for_prompt(prompt).trace(start_node_id)
 
     @classmethod
-    def find_sampler_node_id(cls, trace_tree, sampler_selection_method, node_id):
+    def find_sampler_node_id(cls, trace_tree, sampler_selection_method, node_id, trace_index=None):
         if sampler_selection_method == SAMPLER_SELECTION_METHOD[2]:
-            resolved_node_id = cls._resolve_node_id_in_trace(node_id, trace_tree)
+            resolved_node_id = cls._resolve_node_id_in_trace(node_id, trace_tree, trace_index)
             if resolved_node_id is None:
                 return -1
 
@@ -125,22 +152,33 @@ class Trace:
         return -1
 
     @classmethod
-    def filter_inputs_by_trace_tree(cls, inputs, trace_tree):
+    def filter_inputs_by_trace_tree(cls, inputs, trace_tree, trace_index=None):
+        if trace_index is None:
+            trace_index = TraceIndex({})
         filtered_inputs = {}
         for meta, inputs_list in inputs.items():
-            for node_id, input_value in inputs_list:
-                resolved_node_id = cls._resolve_node_id_in_trace(node_id, trace_tree)
-                if resolved_node_id is None:
-                    continue
+            filtered_entries = cls.filter_entries_by_trace_tree(
+                inputs_list, trace_tree, trace_index
+            )
+            if filtered_entries:
+                filtered_inputs[meta] = filtered_entries
+        return filtered_inputs
 
-                trace = trace_tree.get(resolved_node_id)
-                if trace is not None:
-                    distance = trace[0]
-                    if meta not in filtered_inputs:
-                        filtered_inputs[meta] = []
-                    filtered_inputs[meta].append((node_id, input_value, distance))
+    @classmethod
+    def filter_entries_by_trace_tree(cls, inputs_list, trace_tree, trace_index=None):
+        if trace_index is None:
+            trace_index = TraceIndex({})
+        filtered_entries = []
+        for node_id, input_value in inputs_list:
+            resolved_node_id = trace_index.resolve_in(node_id, trace_tree)
+            if resolved_node_id is None:
+                continue
+
+            trace = trace_tree.get(resolved_node_id)
+            if trace is not None:
+                distance = trace[0]
+                filtered_entries.append((node_id, input_value, distance))
 
         # sort by distance
-        for k, v in filtered_inputs.items():
-            filtered_inputs[k] = sorted(v, key=lambda x: x[2])
-        return filtered_inputs
+        filtered_entries.sort(key=lambda x: x[2])
+        return filtered_entries
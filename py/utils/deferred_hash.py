@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+from .env import env_flag, env_int
+from .hash import PendingHash, calc_hash, prefetch_hashes
+
+# Opt-in: with calc_model_hash on, images are sent to Eagle with placeholder hashes when a
+# model is not hashed yet, and the Eagle items are patched once the hashes are computed.
+DEFERRED_HASH = env_flag("EAGLE_DEFERRED_HASH")
+DEFERRED_HASH_MAX_ATTEMPTS = env_int("EAGLE_DEFERRED_HASH_MAX_ATTEMPTS", 10)
+MAX_RETRY_DELAY = 60.0
+
+
+def collect_pending_hashes(pnginfo_dict):
+    """Returns {placeholder: [filename, algorithm]} for the PendingHash values of pnginfo_dict."""
+    return {
+        str(value): [value.filename, value.algorithm]
+        for value in pnginfo_dict.values()
+        if isinstance(value, PendingHash)
+    }
+
+
+def without_pending_hashes(pnginfo_dict, pending_hashes):
+    """
+    Copy of pnginfo_dict for the metadata embedded in the file.
+
+    Eagle copies the file when it imports it, so only the item can be patched later; the
+    hash fields still waiting for their hash are left out, Hashes map entries included.
+    """
+    file_pnginfo_dict = {
+        key: value for key, value in pnginfo_dict.items() if not isinstance(value, PendingHash)
+    }
+    hashes = file_pnginfo_dict.get("Hashes")
+    if hashes is not None:
+        resource_hashes = {
+            name: value for name, value in json.loads(hashes).items() if value not in pending_hashes
+        }
+        if resource_hashes:
+            file_pnginfo_dict["Hashes"] = json.dumps(resource_hashes)
+        else:
+            del file_pnginfo_dict["Hashes"]
+    return file_pnginfo_dict
+
+
+class DeferredHashQueue:
+    """
+    Eagle items sent with placeholder hashes, waiting for the hashes to be filled in.
+
+    A background thread hashes the files, replaces the placeholders in the annotation and
+    tags and updates the item through /api/item/update. Pending records are kept in a JSON
+    file until their item is updated, so the work resumes after a restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._records = []
+        self._next_try = {}  # record id -> time.monotonic() of the next attempt
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._eagle_api = None
+        self._load()
+
+    def add(self, name, annotation, tags, pending_hashes, response=None):
+        record = {
+            "id": uuid.uuid4().hex,
+            "name": name,
+            "item_id": self._get_item_id(response),
+            "annotation": annotation,
+            "tags": tags,
+            "hashes": pending_hashes,
+            "attempts": 0,
+        }
+        with self._lock:
+            self._records.append(record)
+            self._save()
+        self.start()
+
+    def start(self):
+        with self._lock:
+            if not self._records:
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._work, name="SendToEagle-deferred-hash", daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._records)
+
+    @staticmethod
+    def _get_item_id(response):
+        data = response.get("data") if isinstance(response, dict) else None
+        if isinstance(data, dict):
+            return data.get("id")
+        if isinstance(data, str):
+            return data
+        return None
+
+    def _work(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            with self._lock:
+                if not self._records:
+                    self._thread = None
+                    return
+                due = [r for r in self._records if self._next_try.get(r["id"], 0) <= now]
+
+            for record in due:
+                self._process(record)
+
+            with self._lock:
+                next_tries = [self._next_try.get(r["id"], 0) for r in self._records]
+            if next_tries:
+                self._wakeup.wait(max(0.0, min(next_tries) - time.monotonic()))
+
+    def _process(self, record):
+        try:
+            done = self._patch_item(record)
+        except (OSError, requests.RequestException, ValueError) as e:
+            print(f"Warning: Deferred hash update for '{record['name']}' failed: {e}")
+            done = False
+
+        with self._lock:
+            if done:
+                self._remove(record)
+            else:
+                record["attempts"] += 1
+                if record["attempts"] >= DEFERRED_HASH_MAX_ATTEMPTS:
+                    print(f"Warning: Giving up the deferred hash update for '{record['name']}'")
+                    self._remove(record)
+                else:
+                    delay = min(MAX_RETRY_DELAY, 2.0 ** record["attempts"])
+                    self._next_try[record["id"]] = time.monotonic() + delay
+            self._save()
+
+    def _remove(self, record):
+        self._records.remove(record)
+        self._next_try.pop(record["id"], None)
+
+    def _patch_item(self, record):
+        prefetch_hashes(filename for filename, _ in record["hashes"].values())
+        values = {}
+        for placeholder, (filename, algorithm) in record["hashes"].items():
+            try:
+                values[placeholder] = calc_hash(filename, algorithm)
+            except OSError as e:
+                print(f"Warning: Cannot hash '{filename}': {e}")
+                values[placeholder] = ""
+
+        eagle_api = self._get_eagle_api()
+        item_id = record.get("item_id")
+        if item_id is None:
+            # Eagle imports from the URL asynchronously, so the item may not be listed yet
+            try:
+                item_id = eagle_api.find_item_id(record["name"])
+            except ValueError as e:
+                # another item could get the notes of this one; a retry finds the same items
+                print(f"Warning: Skipping the deferred hash update for '{record['name']}': {e}")
+                return True
+            if item_id is None:
+                return False
+            record["item_id"] = item_id
+
+        eagle_api.update_item(
+            item_id,
+            annotation=self._fill(record["annotation"], values),
+            tags=[self._fill(tag, values) for tag in record["tags"]],
+        )
+        return True
+
+    @staticmethod
+    def _fill(text, values):
+        for placeholder, value in values.items():
+            text = text.replace(placeholder, value)
+        return text
+
+    def _get_eagle_api(self):
+        if self._eagle_api is None:
+            from .eagle_api import EagleAPI
+
+            self._eagle_api = EagleAPI(
+                os.environ.get("EAGLE_SERVER_URL", "http://localhost:41595"),
+                os.environ.get("EAGLE_API_TOKEN", None),
+            )
+        return self._eagle_api
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._records = json.load(f)
+        except FileNotFoundError:
+            self._records = []
+        except (OSError, ValueError) as e:
+            print(f"Warning: Cannot read pending hash updates ({self.path}): {e}")
+            self._records = []
+
+    def _save(self):
+        try:
+            if not self._records:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._records, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Cannot write pending hash updates ({self.path}): {e}")
+
+
+def _get_pending_path():
+    path = os.environ.get("EAGLE_DEFERRED_HASH_PATH")
+    if path:
+        return path
+
+    import folder_paths
+
+    return os.path.join(folder_paths.get_user_directory(), "sendtoeagle_pending_hashes.json")
+
+
+deferred_hash_queue = DeferredHashQueue(_get_pending_path()) if DEFERRED_HASH else None
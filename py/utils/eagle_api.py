@@ -1,3 +1,4 @@
+import os
 from os import name
 from typing import Dict, Optional, TypedDict, Union, List
 import requests
@@ -27,6 +28,34 @@ class EagleAPI:
         return self._send_request("/api/item/addFromURL", method="POST", data=data)
 
 
+    # #########################################
+    # アイテムの annotation / tags を更新
+    def update_item(self, item_id, annotation=None, tags=None):
+        data = {"id": item_id}
+        if annotation is not None:
+            data["annotation"] = annotation
+        if tags is not None:
+            data["tags"] = tags
+        return self._send_request("/api/item/update", method="POST", data=data)
+
+
+    # #########################################
+    # ファイル名（カウンター付きで一意）が一致するアイテムのIDを返す
+    # 見つからなければ None を返す（URLからの取り込みは非同期のため、まだ存在しないことがある）
+    # 複数見つかった場合はどれか判断できないため ValueError
+    def find_item_id(self, file_name):
+        keyword = os.path.splitext(file_name)[0]
+        response = self._send_request("/api/item/list", params={"keyword": keyword, "limit": 50})
+        item_ids = [
+            item.get("id")
+            for item in response.get("data") or []
+            if file_name in (item.get("name"), f"{item.get('name')}.{item.get('ext')}")
+        ]
+        if len(item_ids) > 1:
+            raise ValueError(f"{len(item_ids)} Eagle items are named '{file_name}'")
+        return item_ids[0] if item_ids else None
+
+
     # #########################################
     # フォルダ名 or ID で該当フォルダを探してIDを返す
     # 存在しなければ作成してIDを返す
@@ -91,19 +120,20 @@ class EagleAPI:
 
     # #########################################
     # Private method for sending requests
-    def _send_request(self, endpoint, method="GET", data=None):
+    def _send_request(self, endpoint, method="GET", data=None, params=None):
         url = self.base_url + endpoint
         headers = {"Content-Type": "application/json"}
 
         try:
             if method == "GET":
+                params = dict(params or {})
                 if self.api_token:
-                    url +=  f"?token={self.api_token}"
+                    params["token"] = self.api_token
 
                 if self.basic_auth_id and self.basic_auth_password:
-                    response = requests.get(url, headers=headers, auth=(self.basic_auth_id, self.basic_auth_password))
+                    response = requests.get(url, headers=headers, params=params, auth=(self.basic_auth_id, self.basic_auth_password))
                 else:
-                    response = requests.get(url, headers=headers)
+                    response = requests.get(url, headers=headers, params=params)
             elif method == "POST":
                 if self.api_token:
                     data["token"] = self.api_token
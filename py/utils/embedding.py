@@ -1,6 +1,139 @@
 import os
+import threading
+import time
 from comfy.sd1_clip import expand_directory_list
 
+# How long a validated index is trusted before the directory mtimes are checked again
+INDEX_CHECK_INTERVAL = 2.0
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class EmbeddingIndex:
+    """
+    In-memory index of the files under a list of embedding directories.
+
+    The directories are scanned once; the index is rebuilt only when the mtime of one
+    of the scanned directories changes (a file or subdirectory was added, removed or
+    renamed). Names the index does not know are checked on disk, which also resolves
+    the case-insensitive matches of macOS and Windows file systems.
+    """
+
+    def __init__(self, embedding_directory):
+        self.embedding_directory = embedding_directory
+        self.directories = []
+        self._files = set()
+        self._dir_mtimes = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding_name):
+        with self._lock:
+            self._ensure_fresh()
+            directories = self.directories
+            files = self._files
+
+        candidates = list(self._iter_candidates(directories, embedding_name))
+        for candidate_path in candidates:
+            if os.path.normcase(candidate_path) in files:
+                return candidate_path
+
+        # not indexed: a name differing in case only, or a file added since the last check
+        for candidate_path in candidates:
+            if os.path.isfile(candidate_path):
+                return candidate_path
+
+        return None
+
+    @staticmethod
+    def _iter_candidates(directories, embedding_name):
+        extensions = [".safetensors", ".pt", ".bin"]
+
+        for embed_dir in directories:
+            # Construct the absolute path for the embedding name
+            embed_path = os.path.abspath(os.path.join(embed_dir, embedding_name))
+
+            try:
+                # Ensure embed_path is within embed_dir (security check)
+                if os.path.commonpath([embed_dir, embed_path]) != embed_dir:
+                    continue
+            except Exception:
+                # Skip this directory on exception (e.g., invalid path comparison)
+                continue
+
+            # The file with or without extensions
+            yield embed_path
+            for ext in extensions:
+                yield embed_path + ext
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < INDEX_CHECK_INTERVAL:
+            return
+        if self._checked_at is None or self._is_stale():
+            self._rebuild()
+        self._checked_at = now
+
+    def _is_stale(self):
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _rebuild(self):
+        # Expand directories using the provided function
+        try:
+            embedding_directory = expand_directory_list(self.embedding_directory)
+        except Exception as e:
+            raise ValueError(f"Error expanding directory list: {e}")
+
+        if not embedding_directory:
+            raise ValueError("No valid directories found after expansion.")
+
+        directories = []
+        files = set()
+        dir_mtimes = {}
+        visited = set()
+        for embed_dir in embedding_directory:
+            embed_dir = os.path.abspath(embed_dir)
+            if not os.path.isdir(embed_dir):
+                # Skip invalid directories
+                continue
+            directories.append(embed_dir)
+            self._scan(embed_dir, files, dir_mtimes, visited)
+
+        self.directories = directories
+        self._files = files
+        self._dir_mtimes = dir_mtimes
+
+    @classmethod
+    def _scan(cls, directory, files, dir_mtimes, visited):
+        # symlinked directories are followed like os.path.isfile does, but each real
+        # directory is scanned once, so a link back to a parent cannot recurse forever
+        real_directory = os.path.realpath(directory)
+        if real_directory in visited:
+            return
+        visited.add(real_directory)
+        try:
+            dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    cls._scan(entry.path, files, dir_mtimes, visited)
+                elif entry.is_file():
+                    files.add(os.path.normcase(entry.path))
+            except OSError:
+                continue
+
+
 def get_embedding_file_path(embedding_name, clip):
     """
     Resolves the file path for an embedding by searching directories and checking file extensions.
@@ -21,47 +154,14 @@ def get_embedding_file_path(embedding_name, clip):
     if isinstance(embedding_directory, str):
         embedding_directory = [embedding_directory]
 
-    # Expand directories using the provided function
-    try:
-        embedding_directory = expand_directory_list(embedding_directory)
-    except Exception as e:
-        raise ValueError(f"Error expanding directory list: {e}")
-
-    if not embedding_directory:
-        raise ValueError("No valid directories found after expansion.")
-
-    valid_file = None
-    extensions = [".safetensors", ".pt", ".bin"]
-
-    for embed_dir in embedding_directory:
-        embed_dir = os.path.abspath(embed_dir)
-        if not os.path.isdir(embed_dir):
-            # Skip invalid directories
-            continue
-
-        # Construct the absolute path for the embedding name
-        embed_path = os.path.abspath(os.path.join(embed_dir, embedding_name))
-        
-        try:
-            # Ensure embed_path is within embed_dir (security check)
-            if os.path.commonpath([embed_dir, embed_path]) != embed_dir:
-                continue
-        except Exception as e:
-            # Skip this directory on exception (e.g., invalid path comparison)
-            continue
-
-        # Check if the file exists with or without extensions
-        if os.path.isfile(embed_path):
-            valid_file = embed_path
-        else:
-            for ext in extensions:
-                candidate_path = embed_path + ext
-                if os.path.isfile(candidate_path):
-                    valid_file = candidate_path
-                    break
+    return get_embedding_index(embedding_directory).lookup(embedding_name)
 
-        # Stop searching if a valid file is found
-        if valid_file:
-            break
 
-    return valid_file
+def get_embedding_index(embedding_directory):
+    key = tuple(embedding_directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = EmbeddingIndex(list(embedding_directory))
+            _indexes[key] = index
+    return index
@@ -0,0 +1,156 @@
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from .env import env_int
+
+# Opt-in: number of encoder processes for batches (0 encodes in the node's own thread)
+ENCODE_PROCESSES = env_int("EAGLE_ENCODE_PROCESSES", 0)
+ENCODE_MIN_BATCH = env_int("EAGLE_ENCODE_MIN_BATCH", 2)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "encode_worker.py")
+
+
+class EncodePool:
+    """
+    Encodes the images of a batch on worker processes.
+
+    The uint8 pixels of the whole batch are copied once into a shared memory block; each
+    worker maps its image from there instead of receiving it pickled, and writes the file
+    with the metadata prepared by the node. Results are returned in submission order.
+
+    Workers run encode_worker.py in a fresh interpreter. They inherit none of ComfyUI's
+    threads or CUDA state, and unlike multiprocessing's spawn / forkserver workers they
+    never re-import ComfyUI's main module.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._idle = queue.SimpleQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+        # one thread per worker process feeds it jobs and waits for its results
+        self._executor = ThreadPoolExecutor(
+            max_workers=processes, thread_name_prefix="SendToEagle-encode"
+        )
+
+    def encode(self, jobs):
+        """
+        jobs: (pixels, file_path, save_kwargs) per image, pixels being a uint8 HxWxC array.
+
+        Returns the file paths in the order of jobs. Images a worker failed to write are
+        encoded again in this thread; the first failure of that is raised after every job
+        has finished.
+        """
+        shapes = [np.shape(pixels) for pixels, _, _ in jobs]
+        sizes = [int(np.prod(shape)) for shape in shapes]
+        shm = shared_memory.SharedMemory(create=True, size=max(1, sum(sizes)))
+        try:
+            offsets = []
+            offset = 0
+            for (pixels, _, _), shape, size in zip(jobs, shapes, sizes):
+                np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)[...] = pixels
+                offsets.append(offset)
+                offset += size
+
+            futures = [
+                self._executor.submit(self._run, (shm.name, offset, shape, file_path, save_kwargs))
+                for (_, file_path, save_kwargs), offset, shape in zip(jobs, offsets, shapes)
+            ]
+            error = None
+            results = []
+            for future, (pixels, file_path, save_kwargs) in zip(futures, jobs):
+                try:
+                    results.append(future.result())
+                    continue
+                except Exception as e:
+                    print(f"Warning: Encoder process failed for '{file_path}', encoding it in process: {e}")
+                try:
+                    # a crashed or broken worker must not fail the node
+                    results.append(encode_in_process(pixels, file_path, save_kwargs))
+                except Exception as e:
+                    results.append(None)
+                    if error is None:
+                        error = e
+            if error is not None:
+                raise error
+            return results
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _run(self, job):
+        worker = self._acquire_worker()
+        try:
+            ok, result = worker.run(job)
+        except BaseException:
+            worker.close()
+            with self._lock:
+                self._started -= 1
+            raise
+        self._idle.put(worker)
+        if not ok:
+            raise result
+        return result
+
+    def _acquire_worker(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        # each executor thread holds at most one worker, so a new one is started until
+        # there are as many as threads, and afterwards an idle one is always coming back
+        with self._lock:
+            start = self._started < self.processes
+            if start:
+                self._started += 1
+        if not start:
+            return self._idle.get()
+        try:
+            return _EncodeWorker()
+        except BaseException:
+            with self._lock:
+                self._started -= 1
+            raise
+
+
+def encode_in_process(pixels, file_path, save_kwargs):
+    Image.fromarray(pixels).save(file_path, **save_kwargs)
+    return file_path
+
+
+class _EncodeWorker:
+    def __init__(self):
+        self._process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def run(self, job):
+        """Returns (True, file path) or (False, exception)."""
+        try:
+            pickle.dump(job, self._process.stdin)
+            self._process.stdin.flush()
+            return pickle.load(self._process.stdout)
+        except (EOFError, BrokenPipeError) as e:
+            raise OSError(f"Encoder process exited with code {self._process.poll()}") from e
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+
+
+encode_pool = EncodePool(ENCODE_PROCESSES) if ENCODE_PROCESSES > 0 else None
@@ -0,0 +1,71 @@
+"""
+Worker process of EncodePool.
+
+Started as a standalone script (python encode_worker.py), so it imports nothing but numpy
+and PIL: not ComfyUI's main module, torch or this extension's package. Reads pickled jobs
+from stdin and writes one pickled (ok, result) pair per job to stdout.
+"""
+import os
+import pickle
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image
+
+
+def encode_image(shm_name, offset, shape, file_path, save_kwargs):
+    shm = attach_shared_memory(shm_name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        img = Image.fromarray(pixels)
+        img.save(file_path, **save_kwargs)
+        del img, pixels
+    finally:
+        shm.close()
+    return file_path
+
+
+def attach_shared_memory(name):
+    try:
+        # the parent owns the block; the worker must not register it for cleanup
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # Python < 3.13: on POSIX the worker's own resource tracker would unlink the block on
+    # exit; Windows has no tracker for shared memory and frees it with the last handle
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == "posix":
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except BaseException:
+            shm.close()
+            raise
+    return shm
+
+
+def main():
+    jobs = sys.stdin.buffer
+    results = sys.stdout.buffer
+    # anything printed by PIL or a plugin would corrupt the result stream
+    sys.stdout = sys.stderr
+
+    while True:
+        try:
+            job = pickle.load(jobs)
+        except EOFError:
+            return
+        try:
+            result = pickle.dumps((True, encode_image(*job)))
+        except Exception as e:
+            try:
+                result = pickle.dumps((False, e))
+            except Exception:
+                result = pickle.dumps((False, OSError(f"{type(e).__name__}: {e}")))
+        results.write(result)
+        results.flush()
+
+
+if __name__ == "__main__":
+    main()
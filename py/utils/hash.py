@@ -1,18 +1,445 @@
+import contextlib
+import contextvars
 import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
+from .env import env_flag, env_int
+from .hash_sources import read_precomputed_sha256, write_hash_sidecar
 
-cache_model_hash = {}
 
+# hashing engine settings
+HASH_BUFFER_SIZE = max(1, env_int("EAGLE_HASH_BUFFER_MB", 8)) * 1024 * 1024
+HASH_READ_MODE = os.environ.get("EAGLE_HASH_READ_MODE", "buffered")  # "buffered" or "mmap"
+# Opt-in: a model hashed right before it is loaded would be read from disk again
+HASH_DROP_PAGE_CACHE = env_flag("EAGLE_HASH_DROP_PAGE_CACHE")
+HASH_IO_CONCURRENCY = env_int("EAGLE_HASH_IO_CONCURRENCY", 4)
+HASH_CACHE_SIZE = env_int("EAGLE_HASH_CACHE_SIZE", 1024)
 
-def calc_hash(filename):
-    if filename in cache_model_hash:
-        return cache_model_hash[filename]
-    sha256_hash = hashlib.sha256()
+# what calc_hash returns, labelled as Civitai names the hash types:
+# "autov2" - first 10 hex digits of the file sha256 (A1111 / Civitai default)
+# "autov1" - A1111 legacy model hash, 8 hex digits of 64 KB read at offset 1 MB; constant time.
+#            Checkpoints / UNETs only: other files, and files too small for it, use AutoV2
+# "sha256" - the full file sha256
+HASH_LABELS = {"autov2": "AutoV2", "autov1": "AutoV1", "sha256": "SHA256"}
+DEFAULT_HASH_ALGORITHM = "autov2"
+LEGACY_HASH_OFFSET = 0x100000
+LEGACY_HASH_SIZE = 0x10000
 
+
+def _get_hash_algorithm():
+    algorithm = os.environ.get("EAGLE_HASH_ALGORITHM", DEFAULT_HASH_ALGORITHM).strip().lower()
+    if algorithm not in HASH_LABELS:
+        print(f"Warning: Invalid value for EAGLE_HASH_ALGORITHM: '{algorithm}', using {DEFAULT_HASH_ALGORITHM}")
+        return DEFAULT_HASH_ALGORITHM
+    return algorithm
+
+
+HASH_ALGORITHM = _get_hash_algorithm()
+
+
+class HashCache:
+    """
+    In-memory digests with LRU eviction, safe to share between threads.
+
+    Concurrent requests for the same key are coalesced: the first caller computes the
+    value, the others wait for its result. max_size <= 0 keeps every entry.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._in_flight = {}  # key -> Future of the value
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._in_flight[key] = future
+        if not is_owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if self.max_size > 0:
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PersistentHashCache:
+    """
+    sha256 digests of model files stored in sqlite, so they survive ComfyUI restarts.
+
+    An entry is keyed by the file path and only used while the file keeps the same
+    size, mtime_ns and inode; a replaced file is hashed again.
+
+    The database is opened on first use, not when the extension is imported. path may be
+    a callable returning it. When the database cannot be opened or written (read-only or
+    locked user directory), the digests are kept in memory only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._conn = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        # called with the lock held
+        if self._loaded:
+            return
+        self._loaded = True
+        self._load()
+
+    def _load(self):
+        if callable(self.path):
+            try:
+                self.path = self.path()
+            except Exception as e:
+                print(f"Warning: Model hash cache is not available, keeping hashes in memory only: {e}")
+                return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS model_hashes ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, sha256 TEXT)"
+            )
+            self._conn.commit()
+            for path, size, mtime_ns, inode, sha256 in self._conn.execute(
+                "SELECT path, size, mtime_ns, inode, sha256 FROM model_hashes"
+            ):
+                self._entries[path] = ((size, mtime_ns, inode), sha256)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Model hash cache is not available ({self.path}), keeping hashes in memory only: {e}")
+            self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+
+    def get(self, filename, identity):
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(os.path.abspath(filename))
+        if entry is not None and entry[0] == identity:
+            return entry[1]
+        return None
+
+    def put(self, filename, identity, sha256):
+        path = os.path.abspath(filename)
+        with self._lock:
+            self._ensure_loaded()
+            self._entries[path] = (identity, sha256)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO model_hashes (path, size, mtime_ns, inode, sha256) VALUES (?, ?, ?, ?, ?)",
+                    (path, *identity, sha256),
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: Failed to store model hash for '{path}', keeping hashes in memory only: {e}")
+                self._close()
+
+
+def get_file_identity(filename):
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class LazyHash:
+    """
+    calc_hash of a file, computed only when the capture engine resolves it.
+
+    Selectors and formatters return it in place of a digest, so no model file is read
+    while calc_model_hash is off.
+    """
+
+    __slots__ = ("filename",)
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def resolve(self):
+        return calc_hash(self.filename)
+
+    def __repr__(self):
+        return f"LazyHash({self.filename!r})"
+
+
+class HashValue(str):
+    """calc_hash result of a non-default algorithm, remembering which one produced it."""
+
+    def __new__(cls, value, algorithm):
+        hash_value = super().__new__(cls, value)
+        hash_value.algorithm = algorithm
+        return hash_value
+
+
+class PendingHash(str):
+    """
+    Placeholder that calc_hash returns inside defer_hashes() for a file that is not hashed yet.
+
+    The string value is a token unique to the file and algorithm, so it can be replaced
+    in any text built from it once the hash is known.
+    """
+
+    def __new__(cls, filename, algorithm):
+        digest = hashlib.sha1(f"{algorithm}:{os.path.abspath(filename)}".encode("utf-8")).hexdigest()
+        pending_hash = super().__new__(cls, f"pending-{digest[:12]}")
+        pending_hash.filename = filename
+        pending_hash.algorithm = algorithm
+        return pending_hash
+
+
+_defer_hashes = contextvars.ContextVar("defer_hashes", default=False)
+
+
+@contextlib.contextmanager
+def defer_hashes():
+    """Within this block, calc_hash returns a PendingHash instead of streaming an uncached file."""
+    token = _defer_hashes.set(True)
+    try:
+        yield
+    finally:
+        _defer_hashes.reset(token)
+
+
+def is_hash_available(filename, algorithm=None):
+    """True when calc_hash can answer without reading the whole file."""
+    if algorithm == "autov1" and _has_legacy_hash(filename):
+        return True
+
+    identity = get_file_identity(filename)
+    if hash_cache.contains((os.path.abspath(filename), identity)):
+        return True
+    if persistent_hash_cache is not None and persistent_hash_cache.get(filename, identity) is not None:
+        return True
+    return read_precomputed_sha256(filename, identity) is not None
+
+
+def prefetch_hashes(filenames, max_workers=None):
+    """
+    Hashes the given files concurrently so the following calc_hash calls hit the cache.
+
+    hashlib releases the GIL while digesting, so the wall-clock time approaches that of
+    the largest file. Concurrency is bounded by EAGLE_HASH_IO_CONCURRENCY.
+    """
+    if _defer_hashes.get():
+        # uncached files become placeholders instead of being hashed now
+        return
+
+    filenames = list(dict.fromkeys(filename for filename in filenames if filename))
+    if max_workers is None:
+        max_workers = HASH_IO_CONCURRENCY
+    if len(filenames) <= 1 or max_workers <= 1:
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(filenames)), thread_name_prefix="SendToEagle-hash"
+    ) as executor:
+        futures = [executor.submit(calc_hash, filename) for filename in filenames]
+    for future in futures:
+        # failures surface again from the formatter that needs the hash
+        future.exception()
+
+
+def get_hash_algorithm(checkpoint=False):
+    """
+    Algorithm of the hashes of checkpoints / UNETs (checkpoint=True) or of other files.
+
+    A1111 only ever computed AutoV1 for checkpoints, so LoRAs, VAEs and embeddings keep
+    AutoV2 when EAGLE_HASH_ALGORITHM is autov1.
+    """
+    if HASH_ALGORITHM == "autov1" and not checkpoint:
+        return DEFAULT_HASH_ALGORITHM
+    return HASH_ALGORITHM
+
+
+def calc_hash(filename, algorithm=None):
+    if algorithm is None:
+        algorithm = get_hash_algorithm()
+    if algorithm == "autov1" and not _has_legacy_hash(filename):
+        # AutoV1 of a file shorter than 1 MB + 64 KB would be the hash of too little data
+        algorithm = DEFAULT_HASH_ALGORITHM
+    if _defer_hashes.get() and not is_hash_available(filename, algorithm):
+        return PendingHash(filename, algorithm)
+    if algorithm == "autov1":
+        return HashValue(calc_legacy_hash(filename), algorithm)
+
+    sha256 = calc_sha256(filename)
+    if algorithm == "sha256":
+        return HashValue(sha256, algorithm)
+    return sha256[:10]
+
+
+def get_hash_label(algorithm=None):
+    return HASH_LABELS[algorithm or HASH_ALGORITHM]
+
+
+def get_autov2_hash(value):
+    """AutoV2 form of a calc_hash result, or None when it has none (AutoV1, pending SHA256)."""
+    algorithm = getattr(value, "algorithm", DEFAULT_HASH_ALGORITHM)
+    if algorithm == DEFAULT_HASH_ALGORITHM:
+        return value
+    if algorithm == "sha256" and not isinstance(value, PendingHash):
+        return value[:10]
+    return None
+
+
+def calc_legacy_hash(filename):
+    identity = get_file_identity(filename)
+    return hash_cache.get_or_compute(
+        (os.path.abspath(filename), identity, "autov1"), lambda: _calc_legacy_hash(filename)
+    )
+
+
+def _has_legacy_hash(filename):
+    return os.path.getsize(filename) >= LEGACY_HASH_OFFSET + LEGACY_HASH_SIZE
+
+
+def _calc_legacy_hash(filename):
     with open(filename, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    model_hash = sha256_hash.hexdigest()[:10]
+        f.seek(LEGACY_HASH_OFFSET)
+        return hashlib.sha256(f.read(LEGACY_HASH_SIZE)).hexdigest()[:8]
+
+
+def calc_sha256(filename):
+    identity = get_file_identity(filename)
+    # a file that is already being hashed (e.g. by the pre-hasher) is waited for, not hashed twice
+    return hash_cache.get_or_compute(
+        (os.path.abspath(filename), identity), lambda: _load_or_calc_sha256(filename, identity)
+    )
+
+
+def _load_or_calc_sha256(filename, identity):
+    sha256 = None
+    if persistent_hash_cache is not None:
+        sha256 = persistent_hash_cache.get(filename, identity)
+    if sha256 is None:
+        # hashes recorded by other tools are a few KB away; stream the file only without one
+        sha256 = read_precomputed_sha256(filename, identity)
+        if sha256 is None:
+            sha256 = _calc_sha256(filename)
+            write_hash_sidecar(filename, sha256)
+        if persistent_hash_cache is not None:
+            persistent_hash_cache.put(filename, identity, sha256)
+    return sha256
+
+
+def _calc_sha256(filename):
+    return hash_file(filename).hexdigest()
+
+
+def hash_file(filename, hash_obj=None, buffer_size=None, read_mode=None):
+    """
+    Feeds the whole file into hash_obj (sha256 by default) and returns it.
+
+    read_mode "buffered" reads into one reusable buffer of buffer_size bytes (hashlib
+    releases the GIL while digesting it); "mmap" hands the mapped file to hashlib
+    without copying. The page cache is told the read is sequential and, with
+    EAGLE_HASH_DROP_PAGE_CACHE=1, the hashed pages are released so hashing does
+    not evict other cached model weights.
+    """
+    if hash_obj is None:
+        hash_obj = hashlib.sha256()
+    if buffer_size is None:
+        buffer_size = HASH_BUFFER_SIZE
+    if read_mode is None:
+        read_mode = HASH_READ_MODE
+
+    with open(filename, "rb", buffering=0) as f:
+        fd = f.fileno()
+        file_size = os.fstat(fd).st_size
+        _fadvise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+        if read_mode == "mmap" and file_size > 0:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                hash_obj.update(mm)
+            if HASH_DROP_PAGE_CACHE:
+                _fadvise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+        else:
+            buffer = bytearray(max(1, min(buffer_size, file_size)))
+            view = memoryview(buffer)
+            offset = 0
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                hash_obj.update(view[:size])
+                if HASH_DROP_PAGE_CACHE:
+                    _fadvise(fd, offset, size, "POSIX_FADV_DONTNEED")
+                offset += size
+
+    return hash_obj
+
+
+def _fadvise(fd, offset, length, advice_name):
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+def _get_persistent_cache_path():
+    path = os.environ.get("EAGLE_HASH_CACHE_PATH")
+    if path:
+        return path
+
+    import folder_paths
+
+    return os.path.join(folder_paths.get_user_directory(), "sendtoeagle_model_hashes.db")
+
+
+# (abspath, file identity) -> sha256 hexdigest; a replaced file gets a new key and the old one ages out
+hash_cache = HashCache(HASH_CACHE_SIZE)
 
-    cache_model_hash[filename] = model_hash
-    return model_hash
+# opened when the first hash is looked up; set EAGLE_PERSISTENT_HASH_CACHE=0 to keep hashes in memory only
+persistent_hash_cache = (
+    PersistentHashCache(_get_persistent_cache_path)
+    if env_flag("EAGLE_PERSISTENT_HASH_CACHE", True)
+    else None
+)
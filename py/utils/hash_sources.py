@@ -0,0 +1,183 @@
+import json
+import os
+import re
+import struct
+import threading
+
+from .env import env_flag
+
+# sources consulted before a model file is hashed, cheapest first; see read_precomputed_sha256
+HASH_SOURCES = [
+    source.strip()
+    for source in os.environ.get("EAGLE_HASH_SOURCES", "sidecar,a1111").split(",")
+    if source.strip()
+]
+A1111_CACHE_JSON = os.environ.get("EAGLE_A1111_CACHE_JSON", "")
+WRITE_HASH_SIDECAR = env_flag("EAGLE_WRITE_HASH_SIDECAR")
+
+SIDECAR_SUFFIX = ".sha256"
+SAFETENSORS_HASH_KEYS = ("modelspec.hash_sha256",)
+MAX_SAFETENSORS_HEADER_SIZE = 100 * 1024 * 1024
+
+MODEL_EXTENSIONS = (".safetensors", ".sft", ".ckpt", ".pt", ".pth", ".bin")
+
+_SHA256_PATTERN = re.compile(r"^(?:0x)?([0-9a-fA-F]{64})$")
+
+
+def read_precomputed_sha256(filename, identity):
+    """
+    Returns a sha256 of filename recorded by another tool, or None.
+
+    Sources are tried in the order of EAGLE_HASH_SOURCES (default "sidecar,a1111"):
+    - "sidecar": a "<model>.sha256" file no older than the model
+    - "a1111": the A1111/Forge cache.json given by EAGLE_A1111_CACHE_JSON
+    - "safetensors": modelspec.hash_sha256 in the safetensors header. Trainers usually
+      hash the tensor data only, which differs from the Civitai file hash, so this
+      source is opt-in.
+    """
+    for source in HASH_SOURCES:
+        read = _SOURCES.get(source)
+        if read is None:
+            continue
+        try:
+            sha256 = read(filename, identity)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Cannot read {source} hash for '{filename}': {e}")
+            continue
+        if sha256 is not None:
+            return sha256
+    return None
+
+
+def write_hash_sidecar(filename, sha256):
+    """Writes "<model>.sha256" in sha256sum format when EAGLE_WRITE_HASH_SIDECAR is set."""
+    if not WRITE_HASH_SIDECAR:
+        return
+    try:
+        with open(filename + SIDECAR_SUFFIX, "w", encoding="utf-8") as f:
+            f.write(f"{sha256} *{os.path.basename(filename)}\n")
+    except OSError as e:
+        print(f"Warning: Cannot write hash sidecar for '{filename}': {e}")
+
+
+def _normalize_sha256(value):
+    if not isinstance(value, str):
+        return None
+    match = _SHA256_PATTERN.match(value.strip())
+    if match is None:
+        return None
+    return match.group(1).lower()
+
+
+def _read_sidecar(filename, identity):
+    sidecar = filename + SIDECAR_SUFFIX
+    try:
+        stat = os.stat(sidecar)
+    except FileNotFoundError:
+        return None
+    # a model replaced after the sidecar was written has a different hash
+    if stat.st_mtime_ns < identity[1]:
+        return None
+
+    with open(sidecar, "r", encoding="utf-8") as f:
+        # "<hex>" or the sha256sum format "<hex> *<name>"
+        tokens = f.read(256).split()
+    return _normalize_sha256(tokens[0]) if tokens else None
+
+
+def _read_safetensors_header(filename, identity):
+    if not filename.endswith(".safetensors"):
+        return None
+
+    with open(filename, "rb") as f:
+        prefix = f.read(8)
+        if len(prefix) < 8:
+            return None
+        header_size = struct.unpack("<Q", prefix)[0]
+        if header_size > MAX_SAFETENSORS_HEADER_SIZE or header_size + 8 > identity[0]:
+            return None
+        header = json.loads(f.read(header_size))
+
+    metadata = header.get("__metadata__") if isinstance(header, dict) else None
+    if not isinstance(metadata, dict):
+        return None
+    for key in SAFETENSORS_HASH_KEYS:
+        sha256 = _normalize_sha256(metadata.get(key))
+        if sha256 is not None:
+            return sha256
+    return None
+
+
+class A1111HashCache:
+    """
+    The "hashes" section of an A1111/Forge cache.json, reloaded when the file changes.
+
+    A1111 keys entries by title ("checkpoint/sub/model.safetensors", "lora/model", ...)
+    and records the model mtime, so entries are matched by file stem and mtime.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime_ns = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, filename, identity):
+        entries = self._get_entries()
+        stem = _stem(filename)
+        for mtime, sha256 in entries.get(stem, ()):
+            # A1111 stores os.path.getmtime as a float
+            if abs(mtime * 1e9 - identity[1]) < 1e6:
+                return sha256
+        return None
+
+    def _get_entries(self):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+
+        with self._lock:
+            if mtime_ns != self._mtime_ns:
+                self._entries = self._load()
+                self._mtime_ns = mtime_ns
+            return self._entries
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        entries = {}
+        for title, entry in (data.get("hashes") or {}).items():
+            if not isinstance(entry, dict):
+                continue
+            sha256 = _normalize_sha256(entry.get("sha256"))
+            mtime = entry.get("mtime")
+            if sha256 is None or not isinstance(mtime, (int, float)):
+                continue
+            name = title.split("/", 1)[-1]
+            entries.setdefault(_stem(name), []).append((mtime, sha256))
+        return entries
+
+
+def _stem(filename):
+    # A1111 drops the extension from LoRA and embedding titles, which may still contain dots
+    name = os.path.basename(filename)
+    stem, ext = os.path.splitext(name)
+    return stem if ext.lower() in MODEL_EXTENSIONS else name
+
+
+a1111_hash_cache = A1111HashCache(A1111_CACHE_JSON) if A1111_CACHE_JSON else None
+
+
+def _read_a1111_cache(filename, identity):
+    if a1111_hash_cache is None:
+        return None
+    return a1111_hash_cache.lookup(filename, identity)
+
+
+_SOURCES = {
+    "sidecar": _read_sidecar,
+    "a1111": _read_a1111_cache,
+    "safetensors": _read_safetensors_header,
+}
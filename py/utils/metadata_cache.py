@@ -0,0 +1,197 @@
+import json
+import os
+import re
+import struct
+import threading
+
+import piexif
+import piexif.helper
+from PIL.PngImagePlugin import PngInfo
+
+# "json" (default) writes the same text as json.dumps. "orjson" / "auto" use orjson when it
+# is installed: faster, but compact separators, and NaN / Infinity become null.
+JSON_ENCODER = os.environ.get("EAGLE_JSON_ENCODER", "json").strip().lower()
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def _load_fast_dumps():
+    if JSON_ENCODER not in ("orjson", "auto"):
+        return None
+    try:
+        import orjson
+    except ImportError:
+        if JSON_ENCODER == "orjson":
+            print("Warning: EAGLE_JSON_ENCODER=orjson but orjson is not installed, using json")
+        return None
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    return dumps
+
+
+_fast_dumps = _load_fast_dumps()
+
+
+def dumps_json(obj):
+    """
+    json.dumps through the fast encoder when one is available.
+
+    Like json.dumps, the result is ASCII only, so it still fits a PNG tEXt chunk. Values
+    the fast encoder rejects (non-str keys, custom types) go through the stdlib.
+    """
+    if _fast_dumps is not None:
+        try:
+            text = _fast_dumps(obj)
+        except TypeError:
+            pass
+        else:
+            return text if text.isascii() else _NON_ASCII.sub(_escape_non_ascii, text)
+    return json.dumps(obj)
+
+
+def _escape_non_ascii(match):
+    # non-ASCII characters only occur inside JSON strings, where \u escapes are equivalent
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return "\\u%04x\\u%04x" % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return "\\u%04x" % code
+
+
+class MetadataChunks:
+    """
+    prompt and extra_pnginfo of one execution, serialized once and shared by every image.
+
+    Only the parameters text differs between the images of an execution.
+    """
+
+    def __init__(self, prompt, extra_pnginfo):
+        self.prompt = prompt
+        self.extra_pnginfo = extra_pnginfo
+        self.prompt_json = dumps_json(prompt) if prompt is not None else None
+        self.extra_json = (
+            {key: dumps_json(value) for key, value in extra_pnginfo.items()}
+            if extra_pnginfo is not None
+            else {}
+        )
+        self._png_chunks = None
+        self._exif_template = None
+        self._lock = threading.Lock()
+
+    @property
+    def exif_0th(self):
+        """0th IFD entries holding prompt / extra_pnginfo, as written to WebP and JPEG files."""
+        ifd = {}
+        if self.prompt_json is not None:
+            ifd[0x0110] = "prompt:{}".format(self.prompt_json)
+        inital_exif = 0x010f
+        for x, text in self.extra_json.items():
+            ifd[inital_exif] = "{}:{}".format(x, text)
+            inital_exif -= 1
+        return ifd
+
+    @property
+    def png_chunks(self):
+        """Encoded prompt / extra_pnginfo text chunks, in the order create_pnginfo writes them."""
+        with self._lock:
+            if self._png_chunks is None:
+                template = PngInfo()
+                if self.prompt_json is not None:
+                    template.add_text("prompt", self.prompt_json)
+                for key, text in self.extra_json.items():
+                    template.add_text(key, text)
+                self._png_chunks = tuple(template.chunks)
+            return self._png_chunks
+
+    def exif_bytes(self, user_comment):
+        """
+        piexif.dump of exif_0th plus user_comment (an encoded UserComment).
+
+        The IFDs are dumped once; each call only patches the UserComment byte count and
+        appends the comment, which piexif places at the very end of the data.
+        """
+        with self._lock:
+            if self._exif_template is None:
+                self._exif_template = _build_exif_template(self.exif_0th)
+            template = self._exif_template
+
+        if template is False:
+            return piexif.dump(_exif_dict(self.exif_0th, user_comment))
+        data, count_pos, value_pos, byte_order = template
+        return b"".join((
+            data[:count_pos],
+            struct.pack(byte_order + "L", len(user_comment)),
+            data[count_pos + 4:value_pos],
+            user_comment,
+        ))
+
+
+def _exif_dict(zeroth, user_comment):
+    return {
+        "0th": dict(zeroth),
+        "Exif": {piexif.ExifIFD.UserComment: user_comment},
+        "GPS": {},
+        "Interop": {},
+        "1st": {},
+    }
+
+
+def _build_exif_template(zeroth):
+    """
+    Returns (data, count_pos, value_pos, byte_order) of a dump with an empty UserComment,
+    or False when the comment is not the last value of the dump and cannot be spliced.
+    """
+    placeholder = piexif.helper.UserComment.dump("", "unicode")
+    data = piexif.dump(_exif_dict(zeroth, placeholder))
+
+    tiff = data.index(b"Exif\x00\x00") + 6 if data.startswith(b"Exif") else 0
+    byte_order = ">" if data[tiff:tiff + 2] == b"MM" else "<"
+
+    def find_entry(ifd_offset, tag):
+        (count,) = struct.unpack_from(byte_order + "H", data, tiff + ifd_offset)
+        for i in range(count):
+            pos = tiff + ifd_offset + 2 + i * 12
+            entry_tag, entry_type, entry_count, value = struct.unpack_from(
+                byte_order + "HHLL", data, pos
+            )
+            if entry_tag == tag:
+                return pos, entry_type, entry_count, value
+        return None
+
+    try:
+        (zeroth_offset,) = struct.unpack_from(byte_order + "L", data, tiff + 4)
+        exif_pointer = find_entry(zeroth_offset, piexif.ImageIFD.ExifTag)
+        comment = exif_pointer and find_entry(exif_pointer[3], piexif.ExifIFD.UserComment)
+    except struct.error:
+        comment = None
+    if not comment:
+        return False
+
+    pos, entry_type, count, value = comment
+    value_pos = tiff + value
+    # UNDEFINED, stored out of line, and nothing after it
+    if entry_type != 7 or count != len(placeholder) or value_pos + count != len(data):
+        return False
+    return data[:value_pos], pos + 4, value_pos, byte_order
+
+
+_cached = None
+_cached_lock = threading.Lock()
+
+
+def get_metadata_chunks(prompt, extra_pnginfo):
+    """Returns the MetadataChunks of this prompt / extra_pnginfo pair, built once per execution."""
+    global _cached
+
+    # the lock is held while serializing, so concurrent savers wait for one encode
+    with _cached_lock:
+        if (
+            _cached is not None
+            and _cached.prompt is prompt
+            and _cached.extra_pnginfo is extra_pnginfo
+        ):
+            return _cached
+        _cached = MetadataChunks(prompt, extra_pnginfo)
+        return _cached
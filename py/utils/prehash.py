@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+import folder_paths
+
+from .hash import HASH_CACHE_SIZE, calc_hash, get_hash_algorithm, persistent_hash_cache
+
+# model folders whose hashes the metadata formatters ask for
+PREHASH_FOLDER_NAMES = ["checkpoints", "loras", "unet", "vae", "embeddings"]
+# folders hashed with the checkpoint algorithm (see get_hash_algorithm)
+CHECKPOINT_FOLDER_NAMES = {"checkpoints", "unet"}
+# seconds between the progress lines printed while pre-hashing
+PROGRESS_LOG_INTERVAL = 30.0
+
+
+class ModelPrehasher:
+    """
+    Hashes every file in the model folders on background threads, filling the hash cache
+    before the first save needs it.
+
+    Each file gets the hash the formatters of its folder ask for. Files already in the
+    persistent cache cost one stat. A save that requests a file while a worker is hashing
+    it waits for that computation (see calc_sha256). Without the persistent cache only as
+    many files as the memory cache holds are hashed, as more would evict the first ones.
+    """
+
+    def __init__(self, folder_names=None, workers=2):
+        self.folder_names = folder_names or PREHASH_FOLDER_NAMES
+        self.workers = max(1, workers)
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.finished = False
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._remaining_workers = 0
+        self._last_log = time.monotonic()
+
+    def start(self):
+        # listing may touch slow network folders, so it runs on a worker as well
+        threading.Thread(target=self._enqueue_files, name="SendToEagle-prehash", daemon=True).start()
+
+    def get_progress(self):
+        with self._lock:
+            return {
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "finished": self.finished,
+            }
+
+    def _enqueue_files(self):
+        files = []
+        seen = set()
+        for folder_name in self.folder_names:
+            algorithm = get_hash_algorithm(checkpoint=folder_name in CHECKPOINT_FOLDER_NAMES)
+            try:
+                for name in folder_paths.get_filename_list(folder_name):
+                    filename = folder_paths.get_full_path(folder_name, name)
+                    if filename is not None and (filename, algorithm) not in seen:
+                        seen.add((filename, algorithm))
+                        files.append((filename, algorithm))
+            except Exception as e:
+                print(f"Warning: Cannot list model folder '{folder_name}' for pre-hashing: {e}")
+
+        if persistent_hash_cache is None and 0 < HASH_CACHE_SIZE < len(files):
+            print(
+                f"SendToEagle: pre-hashing the first {HASH_CACHE_SIZE} of {len(files)} model files "
+                "(EAGLE_HASH_CACHE_SIZE) as the persistent hash cache is off"
+            )
+            files = files[:HASH_CACHE_SIZE]
+
+        with self._lock:
+            self.total = len(files)
+            self._remaining_workers = self.workers
+        for file in files:
+            self._queue.put(file)
+
+        for i in range(self.workers):
+            self._queue.put(None)
+            threading.Thread(
+                target=self._work, name=f"SendToEagle-prehash-{i}", daemon=True
+            ).start()
+
+    def _work(self):
+        while True:
+            file = self._queue.get()
+            if file is None:
+                break
+            filename, algorithm = file
+            try:
+                calc_hash(filename, algorithm)
+                with self._lock:
+                    self.done += 1
+                    self._log_progress()
+            except Exception as e:
+                print(f"Warning: Pre-hashing failed for '{filename}': {e}")
+                with self._lock:
+                    self.failed += 1
+                    self._log_progress()
+
+        with self._lock:
+            self._remaining_workers -= 1
+            if self._remaining_workers > 0:
+                return
+            self.finished = True
+            print(f"SendToEagle: pre-hashed {self.done} model files ({self.failed} failed)")
+
+    def _log_progress(self):
+        # called with the lock held
+        now = time.monotonic()
+        if now - self._last_log < PROGRESS_LOG_INTERVAL:
+            return
+        self._last_log = now
+        print(f"SendToEagle: pre-hashing model files, {self.done + self.failed}/{self.total} done")
+
+
+prehasher = None
+
+
+def start_prehash(workers=2):
+    global prehasher
+
+    if prehasher is None:
+        prehasher = ModelPrehasher(workers=workers)
+        prehasher.start()
+    return prehasher
+
+
+def get_prehash_progress():
+    """Progress of the pre-hasher, also served at GET /eagle/prehash/progress; None when it is off."""
+    if prehasher is None:
+        return None
+    return prehasher.get_progress()
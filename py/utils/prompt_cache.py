@@ -0,0 +1,17 @@
+_cache = {}
+
+
+def memoize_on_prompt(name, prompt, build):
+    """
+    Returns build(prompt), computed once per prompt object.
+
+    The prompt dict cannot carry attributes, so the value is kept beside a
+    reference to the prompt and rebuilt when a different prompt object arrives.
+    """
+    cached = _cache.get(name)
+    if cached is not None and cached[0] is prompt:
+        return cached[1]
+
+    value = build(prompt)
+    _cache[name] = (prompt, value)
+    return value
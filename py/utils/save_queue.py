@@ -0,0 +1,171 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .env import env_flag, env_int
+
+# Opt-in: encode, write and send images on background threads so the node returns right away
+ASYNC_SAVE = env_flag("EAGLE_ASYNC_SAVE")
+ASYNC_SAVE_WORKERS = env_int("EAGLE_ASYNC_SAVE_WORKERS", 2)
+ASYNC_SAVE_MAX_PENDING = env_int("EAGLE_ASYNC_SAVE_MAX_PENDING", 8)
+
+
+class SaveQueue:
+    """
+    Bounded background executor for the encode, write and send step of each image.
+
+    submit blocks while max_pending jobs are queued or running, so a fast producer cannot
+    pile up decoded images in memory. Jobs are grouped by the node that submitted them;
+    wait(node_id) returns once that node's files are written, and raises the failures
+    of its jobs until then.
+    """
+
+    def __init__(self, workers, max_pending):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="SendToEagle-save"
+        )
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._pending = {}  # node id -> set of futures
+        self._failed = {}  # node id -> exceptions of its jobs not yet raised by wait
+        self._last_step = {}  # node id -> event set once its last submitted job ran `then`
+        self._reserved_counters = {}  # (folder, filename) -> set of counters being written
+
+    def reserve_counter(self, folder, filename, counter):
+        """
+        Returns a filename counter no queued job is using, and holds it until the job ends.
+
+        get_save_image_path only sees the files already on disk, so without this two
+        queued images could be given the same counter.
+        """
+        key = (folder, filename)
+        with self._lock:
+            reserved = self._reserved_counters.setdefault(key, set())
+            if reserved:
+                counter = max(counter, max(reserved) + 1)
+            reserved.add(counter)
+        return counter
+
+    def submit(self, node_id, fn, *args, then=None, reservations=()):
+        """
+        Runs fn(*args) in the background, then then() once the `then` of every job node_id
+        submitted before has run: the jobs write in parallel but send in submission order.
+        """
+        self._slots.acquire()
+        step = threading.Event()
+        with self._lock:
+            previous_step = self._last_step.get(node_id)
+            self._last_step[node_id] = step
+        try:
+            future = self._executor.submit(self._run, fn, args, then, previous_step, step)
+        except BaseException:
+            step.set()
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._pending.setdefault(node_id, set()).add(future)
+        future.add_done_callback(lambda f: self._done(node_id, f, step, reservations))
+        return future
+
+    @staticmethod
+    def _run(fn, args, then, previous_step, step):
+        try:
+            result = fn(*args)
+            if then is not None:
+                # the executor starts jobs in submission order, so the previous one is
+                # already running or done and this wait cannot deadlock
+                if previous_step is not None:
+                    previous_step.wait()
+                then()
+            return result
+        finally:
+            step.set()
+
+    def has_pending(self, node_id):
+        with self._lock:
+            return bool(self._pending.get(node_id))
+
+    def wait(self, node_id=None):
+        """
+        Blocks until the jobs of node_id (all jobs if None) are done, then raises the first
+        failure among them, including jobs that had already finished. A failure is raised once.
+        """
+        with self._lock:
+            if node_id is None:
+                futures = [f for pending in self._pending.values() for f in pending]
+            else:
+                futures = list(self._pending.get(node_id, ()))
+
+        for future in futures:
+            future.exception()
+
+        with self._lock:
+            if node_id is None:
+                errors = [e for failed in self._failed.values() for e in failed]
+                self._failed.clear()
+            else:
+                errors = self._failed.pop(node_id, [])
+        if errors:
+            raise errors[0]
+
+    def _done(self, node_id, future, step, reservations):
+        exception = future.exception()
+        with self._lock:
+            if exception is not None:
+                self._failed.setdefault(node_id, []).append(exception)
+            pending = self._pending.get(node_id)
+            if pending is not None:
+                pending.discard(future)
+                if not pending:
+                    del self._pending[node_id]
+            if self._last_step.get(node_id) is step:
+                del self._last_step[node_id]
+            for key, counter in reservations:
+                reserved = self._reserved_counters.get(key)
+                if reserved is not None:
+                    reserved.discard(counter)
+                    if not reserved:
+                        del self._reserved_counters[key]
+        self._slots.release()
+
+        if exception is not None:
+            print(f"Warning: Saving an image in the background failed: {exception}")
+
+
+class BatchCounters:
+    """
+    Filename counters handed out by one run of a save node.
+
+    get_save_image_path only counts the files on disk, so images of the run that are still
+    waiting in a chunk for the encoder pool, or queued on the SaveQueue, would get the
+    counter of an earlier one. Each counter is at least one past the last handed out for
+    the same folder and filename, and is reserved on the queue until its job ends.
+    """
+
+    def __init__(self, queue=None):
+        self._queue = queue
+        self._last = {}  # (folder, filename) -> last counter handed out
+
+    def next(self, folder, filename, counter):
+        key = (folder, filename)
+        counter = max(counter, self._last.get(key, -1) + 1)
+        if self._queue is not None:
+            counter = self._queue.reserve_counter(folder, filename, counter)
+        self._last[key] = counter
+        return counter
+
+
+save_queue = SaveQueue(ASYNC_SAVE_WORKERS, ASYNC_SAVE_MAX_PENDING) if ASYNC_SAVE else None
+
+
+def wait_for_saves(node_id=None):
+    """
+    Flush API: returns once the background saves of node_id (or of every node) are done,
+    raising the first failure. A no-op unless EAGLE_ASYNC_SAVE is on.
+
+    Nodes linked to the filepath output of a save node are already waited for (see
+    hook.wait_for_filepath_inputs); other code that reads the saved files, e.g. through the
+    output folder, calls this first.
+    """
+    if save_queue is not None:
+        save_queue.wait(node_id)
@@ -0,0 +1,28 @@
+import importlib
+import os
+import sys
+import types
+from pathlib import Path
+
+PY_DIR = Path(__file__).resolve().parents[1] / "py"
+
+# tests must not open or write the hash database in ComfyUI's user directory
+os.environ.setdefault("EAGLE_PERSISTENT_HASH_CACHE", "0")
+
+
+def load_module(name):
+    """
+    Imports py/<name> ("utils.hash", "defs.validators") without running the __init__ of
+    py or its subpackages: py/__init__.py patches ComfyUI's execution module.
+    """
+    package_name = "sendtoeagle"
+    package_dir = PY_DIR
+    for part in [""] + name.split(".")[:-1]:
+        if part:
+            package_name += "." + part
+            package_dir = package_dir / part
+        if package_name not in sys.modules:
+            package = types.ModuleType(package_name)
+            package.__path__ = [str(package_dir)]
+            sys.modules[package_name] = package
+    return importlib.import_module(f"sendtoeagle.{name}")
@@ -0,0 +1,87 @@
+import os
+import random
+import re
+import tempfile
+import time
+import unittest
+
+from support import load_module
+
+CHUNK_SIZE = 3
+
+
+def get_disk_counter(folder, filename):
+    """The counter folder_paths.get_save_image_path returns: one past the highest on disk."""
+    pattern = re.compile(re.escape(filename) + r"_(\d+)_")
+    counters = [int(m.group(1)) for m in map(pattern.match, os.listdir(folder)) if m]
+    return max(counters, default=0) + 1
+
+
+def write_files(paths):
+    time.sleep(random.random() * 0.02)
+    for path in paths:
+        with open(path, "wb"):
+            pass
+
+
+class BatchCountersTest(unittest.TestCase):
+    def setUp(self):
+        self.save_queue = load_module("utils.save_queue")
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        os.rmdir(self.folder)
+
+    def save_images(self, count, queue):
+        """The counter handling of send_to_eagle's streaming loop, writing a chunk at a time."""
+        batch_counters = self.save_queue.BatchCounters(queue)
+        chunk = []
+        reservations = []
+        for _ in range(count):
+            counter = get_disk_counter(self.folder, "img")
+            counter = batch_counters.next(self.folder, "img", counter)
+            chunk.append(os.path.join(self.folder, f"img_{counter:05}_.png"))
+            if queue is not None:
+                reservations.append(((self.folder, "img"), counter))
+            if len(chunk) >= CHUNK_SIZE:
+                self.flush(queue, chunk, reservations)
+                chunk = []
+                reservations = []
+        if chunk:
+            self.flush(queue, chunk, reservations)
+        if queue is not None:
+            queue.wait()
+
+    def flush(self, queue, paths, reservations):
+        if queue is None:
+            write_files(paths)
+        else:
+            queue.submit("1", write_files, paths, reservations=reservations)
+
+    def assert_counters(self, expected):
+        self.assertEqual(
+            sorted(os.listdir(self.folder)), [f"img_{counter:05}_.png" for counter in expected]
+        )
+
+    def test_chunks_written_in_process_get_consecutive_counters(self):
+        self.save_images(8, None)
+        self.save_images(4, None)
+        self.assert_counters(range(1, 13))
+
+    def test_chunks_saved_in_the_background_get_consecutive_counters(self):
+        queue = self.save_queue.SaveQueue(workers=3, max_pending=2)
+        self.save_images(10, queue)
+        self.save_images(5, queue)
+        self.assert_counters(range(1, 16))
+
+    def test_counters_after_existing_files_are_not_reused(self):
+        write_files([os.path.join(self.folder, "img_00007_.png")])
+        queue = self.save_queue.SaveQueue(workers=2, max_pending=2)
+        self.save_images(7, queue)
+        self.assert_counters(range(7, 15))
+
+
+if __name__ == "__main__":
+    unittest.main()
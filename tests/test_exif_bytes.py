@@ -0,0 +1,50 @@
+import json
+import unittest
+
+import piexif
+import piexif.helper
+
+from support import load_module
+
+PROMPT = {"3": {"class_type": "KSampler", "inputs": {"seed": 1, "text": "猫"}}}
+EXTRA_PNGINFO = {"workflow": {"nodes": [{"id": 3, "type": "KSampler"}]}}
+
+
+def dump_exif(prompt, extra_pnginfo, parameters):
+    """What create_exif_bytes dumped for an image without EXIF before the template splice."""
+    metadata = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}}
+    metadata["0th"][0x0110] = "prompt:{}".format(json.dumps(prompt))
+    inital_exif = 0x010f
+    for x in extra_pnginfo:
+        metadata["0th"][inital_exif] = "{}:{}".format(x, json.dumps(extra_pnginfo[x]))
+        inital_exif -= 1
+    metadata["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(parameters, "unicode")
+    return piexif.dump(metadata)
+
+
+class ExifBytesTest(unittest.TestCase):
+    def setUp(self):
+        self.metadata_cache = load_module("utils.metadata_cache")
+
+    def assert_same_as_piexif(self, parameters):
+        chunks = self.metadata_cache.MetadataChunks(PROMPT, EXTRA_PNGINFO)
+        user_comment = piexif.helper.UserComment.dump(parameters, "unicode")
+        self.assertEqual(chunks.exif_bytes(user_comment), dump_exif(PROMPT, EXTRA_PNGINFO, parameters))
+
+    def test_ascii_comment(self):
+        self.assert_same_as_piexif("masterpiece, 1girl\nSteps: 20, Sampler: euler, Seed: 1")
+
+    def test_non_ascii_comment(self):
+        self.assert_same_as_piexif("傑作、猫耳 ✨\nNegative prompt: 低品質\nSteps: 20")
+
+    def test_comments_of_other_lengths_reuse_the_template(self):
+        chunks = self.metadata_cache.MetadataChunks(PROMPT, EXTRA_PNGINFO)
+        for parameters in ("", "a", "x" * 5000, "a cat"):
+            user_comment = piexif.helper.UserComment.dump(parameters, "unicode")
+            self.assertEqual(
+                chunks.exif_bytes(user_comment), dump_exif(PROMPT, EXTRA_PNGINFO, parameters)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import threading
+import unittest
+
+from support import load_module
+
+
+class HashCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.hash_module = load_module("utils.hash")
+
+    def test_concurrent_callers_share_one_compute(self):
+        cache = self.hash_module.HashCache(8)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(None)
+            started.set()
+            release.wait(5)
+            return "digest"
+
+        results = []
+        owner = threading.Thread(target=lambda: results.append(cache.get_or_compute("a", compute)))
+        owner.start()
+        self.assertTrue(started.wait(5))
+        waiters = [
+            threading.Thread(target=lambda: results.append(cache.get_or_compute("a", compute)))
+            for _ in range(4)
+        ]
+        for waiter in waiters:
+            waiter.start()
+        release.set()
+        for thread in [owner, *waiters]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["digest"] * 5)
+
+    def test_failed_compute_is_not_cached(self):
+        cache = self.hash_module.HashCache(8)
+
+        def fail():
+            raise OSError("read error")
+
+        with self.assertRaises(OSError):
+            cache.get_or_compute("a", fail)
+        self.assertFalse(cache.contains("a"))
+        self.assertEqual(cache.get_or_compute("a", lambda: "digest"), "digest")
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = self.hash_module.HashCache(2)
+        cache.get_or_compute("a", lambda: "1")
+        cache.get_or_compute("b", lambda: "2")
+        # touching "a" makes "b" the oldest entry
+        cache.get_or_compute("a", lambda: "unused")
+        cache.get_or_compute("c", lambda: "3")
+
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.contains("a"))
+        self.assertFalse(cache.contains("b"))
+        self.assertTrue(cache.contains("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
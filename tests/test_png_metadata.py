@@ -0,0 +1,69 @@
+import io
+import json
+import struct
+import unittest
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from support import load_module
+
+
+def get_from_png_buffer(data):
+    """
+    Port of getFromPngBuffer in ComfyUI's frontend (src/scripts/metadata/png.ts), which
+    reads the workflow of a PNG file dropped onto the canvas. Only the uncompressed text
+    chunks this extension writes are read.
+    """
+    assert struct.unpack_from(">I", data, 0)[0] == 0x89504E47
+    offset = 8
+    chunks = {}
+    while offset < len(data):
+        (length,) = struct.unpack_from(">I", data, offset)
+        chunk_type = data[offset + 4:offset + 8].decode("latin-1")
+        end = offset + 8 + length
+        if chunk_type in ("tEXt", "comf"):
+            keyword_end = data.index(b"\0", offset + 8)
+            keyword = data[offset + 8:keyword_end].decode("latin-1")
+            chunks[keyword] = data[keyword_end + 1:end].decode("utf-8")
+        offset += 12 + length
+    return chunks
+
+
+def save_png(metadata_cache, prompt, extra_pnginfo):
+    metadata = PngInfo()
+    metadata.add_text("parameters", "masterpiece\nSteps: 20")
+    metadata.chunks.extend(metadata_cache.MetadataChunks(prompt, extra_pnginfo).png_chunks)
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "png", pnginfo=metadata)
+    return buffer.getvalue()
+
+
+class PngMetadataLoaderTest(unittest.TestCase):
+    """
+    ComfyUI reads the workflow of a dropped PNG with getFromPngBuffer. It skips zTXt, and
+    inflates compressed iTXt through a DecompressionStream that is written before it is read,
+    which stalls on backpressure, so prompt / workflow must stay uncompressed tEXt.
+    """
+
+    def setUp(self):
+        self.metadata_cache = load_module("utils.metadata_cache")
+
+    def test_large_workflow_is_read_by_comfyui_loader(self):
+        prompt = {"3": {"class_type": "KSampler", "inputs": {"seed": 1, "steps": 20}}}
+        workflow = {"nodes": [{"id": i, "type": "KSampler", "title": "ノード"} for i in range(2000)]}
+
+        data = save_png(self.metadata_cache, prompt, {"workflow": workflow})
+        chunks = get_from_png_buffer(data)
+
+        self.assertEqual(json.loads(chunks["workflow"]), workflow)
+        self.assertEqual(json.loads(chunks["prompt"]), prompt)
+        self.assertEqual(chunks["parameters"], "masterpiece\nSteps: 20")
+        self.assertIn(b"tEXtprompt\0", data)
+        self.assertIn(b"tEXtworkflow\0", data)
+        self.assertNotIn(b"zTXt", data)
+        self.assertNotIn(b"iTXt", data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from collections import deque
+
+from support import load_module
+
+
+def link(node_id):
+    return [node_id, 0]
+
+
+# two KSamplers sharing a negative prompt, a refiner behind a combine node, a Flux guider,
+# a diamond that reaches the same encoder twice and a sampler without a negative input
+PROMPT = {
+    "1": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat", "clip": link("20")}},
+    "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "bad", "clip": link("20")}},
+    "3": {"class_type": "KSampler", "inputs": {"positive": link("1"), "negative": link("2"), "model": link("20")}},
+    "4": {"class_type": "CLIPTextEncode", "inputs": {"text": "a dog", "clip": link("20")}},
+    "5": {"class_type": "KSampler", "inputs": {"positive": link("4"), "negative": link("2"), "model": link("20")}},
+    "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "detailed", "clip": link("20")}},
+    "7": {"class_type": "ConditioningCombine", "inputs": {"conditioning_1": link("6"), "conditioning_2": link("1")}},
+    "8": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": link("20")}},
+    "9": {"class_type": "KSamplerAdvanced", "inputs": {"positive": link("7"), "negative": link("8"), "model": link("20")}},
+    "10": {"class_type": "CLIPTextEncode", "inputs": {"text": "a fox", "clip": link("20")}},
+    "11": {"class_type": "FluxGuidance", "inputs": {"conditioning": link("10"), "guidance": 3.5}},
+    "12": {"class_type": "BasicGuider", "inputs": {"conditioning": link("11"), "model": link("20")}},
+    "13": {"class_type": "SamplerCustomAdvanced", "inputs": {"guider": link("12"), "noise": link("21")}},
+    "14": {"class_type": "ConditioningZeroOut", "inputs": {"conditioning": link("8")}},
+    "15": {"class_type": "ConditioningConcat", "inputs": {"conditioning_to": link("14"), "conditioning_from": link("14")}},
+    "16": {"class_type": "KSampler", "inputs": {"positive": link("15"), "model": link("20")}},
+    "20": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+    "21": {"class_type": "RandomNoise", "inputs": {"noise_seed": 1}},
+}
+
+
+def get_node_id_list_by_scan(prompt, field_name, samplers, text_encode_classes):
+    """The validators' search before the per-prompt index: every sampler, on every call."""
+    node_id_list = {}
+    for nid, node in prompt.items():
+        for sampler_type, field_map in samplers.items():
+            if node["class_type"] == sampler_type:
+                d = deque()
+                if field_name in field_map and field_map[field_name] in node["inputs"]:
+                    d.append(node["inputs"][field_map[field_name]][0])
+                while len(d) > 0:
+                    nid2 = d.popleft()
+                    class_type = prompt[nid2]["class_type"]
+                    if class_type in text_encode_classes:
+                        node_id_list[nid] = nid2
+                        break
+                    inputs = prompt[nid2]["inputs"]
+                    for k, v in inputs.items():
+                        if isinstance(v, list):
+                            d.append(v[0])
+
+    return node_id_list.values()
+
+
+class TextEncodeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.validators = load_module("defs.validators")
+        self.samplers = load_module("defs.samplers").SAMPLERS
+        self.text_encode_classes = load_module("defs.textencodes").TEXT_ENCODE_CLASSES
+
+    def classify(self, prompt):
+        return {
+            node_id: (
+                self.validators.is_positive_prompt(node_id, None, prompt, None, None, None),
+                self.validators.is_negative_prompt(node_id, None, prompt, None, None, None),
+            )
+            for node_id in prompt
+        }
+
+    def test_index_matches_the_scan_on_a_multi_sampler_graph(self):
+        positive = set(get_node_id_list_by_scan(PROMPT, "positive", self.samplers, self.text_encode_classes))
+        negative = set(get_node_id_list_by_scan(PROMPT, "negative", self.samplers, self.text_encode_classes))
+
+        for node_id, (is_positive, is_negative) in self.classify(PROMPT).items():
+            self.assertEqual(is_positive, node_id in positive, node_id)
+            self.assertEqual(is_negative, node_id in negative, node_id)
+        self.assertEqual(positive, {"1", "4", "6", "10", "8"})
+        self.assertEqual(negative, {"2", "8"})
+
+    def test_index_is_rebuilt_for_another_prompt(self):
+        self.classify(PROMPT)
+        prompt = {node_id: node for node_id, node in PROMPT.items() if node_id not in ("3", "5")}
+
+        classified = self.classify(prompt)
+        self.assertEqual(classified["2"], (False, False))
+        self.assertEqual(classified["1"], (False, False))
+        self.assertEqual(classified["6"], (True, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Compares the model hashing engine in py/utils/hash.py with the former 4 KB read loop.
+
+Usage:
+    python tools/benchmark_hash.py <model file> [<model file> ...] [--repeat N] [--buffer-mb N]
+
+Runs outside ComfyUI; the persistent hash cache is disabled for the run.
+Before each run the file's pages are dropped from the page cache where
+posix_fadvise is available, so every variant starts equally cold.
+"""
+import argparse
+import hashlib
+import importlib
+import os
+import sys
+import time
+import types
+
+UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "py", "utils")
+
+
+def load_hash_module():
+    os.environ["EAGLE_PERSISTENT_HASH_CACHE"] = "0"
+    # import py/utils as a standalone package so py/__init__.py (which needs ComfyUI) is not run
+    package = types.ModuleType("sendtoeagle_utils")
+    package.__path__ = [os.path.abspath(UTILS_DIR)]
+    sys.modules["sendtoeagle_utils"] = package
+    return importlib.import_module("sendtoeagle_utils.hash")
+
+
+def legacy_sha256(filename):
+    sha256_hash = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for byte_block in iter(lambda: f.read(4096), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+
+def drop_page_cache(filename):
+    if not hasattr(os, "posix_fadvise"):
+        return
+    with open(filename, "rb") as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def measure(fn, filename, repeat):
+    best = None
+    digest = None
+    for _ in range(repeat):
+        drop_page_cache(filename)
+        start = time.perf_counter()
+        digest = fn(filename)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--buffer-mb", type=int, default=8)
+    args = parser.parse_args()
+
+    hash_module = load_hash_module()
+    buffer_size = args.buffer_mb * 1024 * 1024
+    variants = [
+        ("4 KB loop (previous)", legacy_sha256),
+        (
+            f"buffered {args.buffer_mb} MB",
+            lambda f: hash_module.hash_file(f, buffer_size=buffer_size, read_mode="buffered").hexdigest(),
+        ),
+        ("mmap", lambda f: hash_module.hash_file(f, read_mode="mmap").hexdigest()),
+    ]
+
+    for filename in args.files:
+        size_mb = os.path.getsize(filename) / (1024 * 1024)
+        print(f"{filename} ({size_mb:.1f} MB)")
+        digests = set()
+        for name, fn in variants:
+            elapsed, digest = measure(fn, filename, args.repeat)
+            digests.add(digest)
+            print(f"  {name:<22} {elapsed:8.3f} s  {size_mb / elapsed if elapsed else 0:10.1f} MB/s")
+        if len(digests) != 1:
+            print("  ERROR: digests differ between variants")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())